@@ -0,0 +1,69 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Worker threads shared by every session of the app
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="check")
+
+
+class Cancelled(Exception):
+    """Raised inside a background run at its next stage once cancelled."""
+
+
+class BackgroundRun:
+    """A computation running in a worker thread, with progress and partials.
+
+    work(run) runs in the worker. It passes run.stage_listener to the
+    checker, so progress is reported at every pipeline stage and a
+    cancelled run stops at the next one, and it can publish() partial
+    results for display before it finishes. key identifies the settings
+    the run was started for.
+    """
+
+    def __init__(self, key, work, expected_stages=()):
+        self.key = key
+        self.expected_stages = list(expected_stages)
+        self.completed = []
+        self.current = None
+        self.partial = {}
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self.future = _executor.submit(work, self)
+
+    def stage_listener(self, name, event):
+        if self.cancelled.is_set():
+            raise Cancelled(f"Cancelled before {name}.")
+        with self.lock:
+            if event == "start":
+                self.current = name
+            else:
+                self.completed.append(name)
+                self.current = None
+
+    def publish(self, name, value):
+        """Make a partial result available to the UI thread."""
+        with self.lock:
+            self.partial[name] = value
+
+    def progress(self):
+        """Fraction of the expected stages done, and a line describing it."""
+        with self.lock:
+            completed = list(self.completed)
+            current = self.current
+        total = max(len(self.expected_stages), len(completed) + (current is not None))
+        fraction = len(completed) / total if total else 0.0
+        if current is None and len(completed) >= total:
+            return 1.0, "Done."
+        step = f"{current}..." if current is not None else "starting..."
+        return fraction, f"Step {len(completed) + 1} of {total}: {step}"
+
+    def cancel(self):
+        """Ask the run to stop at its next stage; a queued run never starts."""
+        self.cancelled.set()
+        self.future.cancel()
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        """The value work() returned; raises what it raised."""
+        return self.future.result()
@@ -0,0 +1,316 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from checkContamination import ContaminationChecker
+from curated_store import load_curated, load_overlay, load_score_weights
+from export import WRITERS, frame_chunks, missing_module
+from input_store import is_table, load_input, open_table
+
+
+def check_file(
+    checker,
+    input_path,
+    score_weights,
+    score_threshold,
+    reads_threshold,
+    chunk_rows=None,
+    with_burden=False,
+):
+    """Run the contamination check on one input CSV without any UI.
+
+    Returns a dict with the statistics shown in the app ("Num", "Matched",
+    "Above Threshold"), the filtered and reverse tables (None when nothing
+    passes), the unmatched rows, the checker's diagnostics and its per-stage
+    profile. With chunk_rows the input is streamed in blocks of that many
+    rows. input_path may also be a table made by ingest.py. with_burden
+    adds the per-location burden table ("burden"), else None.
+    """
+    if chunk_rows:
+        if is_table(input_path):
+            # Blocks of a memory-mapped table are views, read as they are used
+            chunks = frame_chunks(open_table(input_path)[0], chunk_rows)
+        else:
+            chunks = pd.read_csv(input_path, chunksize=chunk_rows)
+        matching_rows, filtered_bacteria, thresh_rows, reverse_table = (
+            checker.filter_bacteria_chunked(
+                chunks,
+                score_weights,
+                score_threshold,
+                reads_threshold,
+            )
+        )
+        num_rows = checker.num_input_rows
+    else:
+        input_df, _ = load_input(input_path)
+        matching_rows, filtered_bacteria, thresh_rows, reverse_table = (
+            checker.filter_bacteria(
+                input_df, score_weights, score_threshold, reads_threshold
+            )
+        )
+        num_rows = len(input_df)
+    burden = None
+    if isinstance(filtered_bacteria, int):
+        filtered_bacteria = reverse_table = None
+    elif with_burden:
+        burden = checker.location_burden(filtered_bacteria).reset_index()
+    return {
+        "input": input_path,
+        "Num": num_rows,
+        "Matched": matching_rows,
+        "Above Threshold": thresh_rows,
+        "filtered": filtered_bacteria,
+        "reverse": reverse_table,
+        "burden": burden,
+        "unmatched": checker.non_matching_rows_df,
+        "diagnostics": list(checker.diagnostics),
+        "profile": checker.profile,
+    }
+
+
+def write_results(result, output_dir, with_profile=False, fmt="csv"):
+    """Write the filtered and reverse tables for one input to output_dir.
+
+    fmt is "csv" or "parquet"; tables are written a block of rows at a time.
+    with_profile also writes the per-stage profile as JSON.
+    """
+    stem = os.path.splitext(os.path.basename(result["input"]))[0]
+    names = ["filtered", "reverse"]
+    if result["burden"] is not None:
+        names.append("burden")
+    for name in names:
+        table = result[name]
+        if table is None:
+            table = pd.DataFrame()
+        elif name == "filtered":
+            # The bit mask is internal; "Contributing Properties" has its names
+            table = table.drop(columns="Property Mask")
+        with open(os.path.join(output_dir, f"{stem}_{name}.{fmt}"), "wb") as f:
+            WRITERS[fmt](frame_chunks(table), f)
+    if with_profile:
+        with open(os.path.join(output_dir, f"{stem}_profile.json"), "w") as f:
+            f.write(result["profile"].to_json(indent=2))
+
+
+def process_file(checker, input_path, args):
+    """Check one input, write its tables and return its summary row.
+
+    An input that cannot be checked or written does not stop the batch: its
+    row has the error in "Error" and no counts.
+    """
+    try:
+        result = check_file(
+            checker,
+            input_path,
+            checker.default_score_weights,
+            args.score_threshold,
+            args.reads_threshold,
+            args.chunk_rows,
+            args.burden,
+        )
+        write_results(result, args.output_dir, args.profile, args.format)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        print(f"{input_path}: error: {error}", file=sys.stderr)
+        return {
+            "input": input_path,
+            "Num": None,
+            "Matched": None,
+            "Above Threshold": None,
+            "Error": error,
+        }
+    for diagnostic in result["diagnostics"]:
+        print(
+            f"{input_path}: {diagnostic['level']}: {diagnostic['message']}",
+            file=sys.stderr,
+        )
+    row = {key: result[key] for key in ("input", "Num", "Matched", "Above Threshold")}
+    row["Error"] = None
+    return row
+
+
+# Per-process checker for pool workers, built once by init_worker
+_worker_checker = None
+
+
+def init_worker(
+    curated_store, score_weights, sparse_counts, trace_memory, loose, score_bound
+):
+    global _worker_checker
+    _worker_checker = ContaminationChecker(
+        curated_store.curated_df,
+        score_weights,
+        curated_store,
+        sparse_counts,
+        trace_memory,
+        loose,
+        score_bound,
+    )
+
+
+def process_file_in_worker(input_path, args):
+    return process_file(_worker_checker, input_path, args)
+
+
+def run_batch(curated_store, score_weights, args):
+    """Check every input, in a process pool when more than one job is used.
+
+    Workers receive the curated store once at startup, with its property
+    matrix memory-mapped from a temporary file instead of pickled.
+    """
+    jobs = min(args.jobs or os.cpu_count() or 1, len(args.inputs))
+    if jobs <= 1:
+        checker = ContaminationChecker(
+            curated_store.curated_df,
+            score_weights,
+            curated_store,
+            args.sparse,
+            args.profile,
+            args.loose_matching,
+            args.score_bound,
+        )
+        return [process_file(checker, path, args) for path in args.inputs]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        shared_store = curated_store.shared_copy(os.path.join(tmp_dir, "matrix.npy"))
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=init_worker,
+            initargs=(
+                shared_store,
+                score_weights,
+                args.sparse,
+                args.profile,
+                args.loose_matching,
+                args.score_bound,
+            ),
+        ) as executor:
+            return list(
+                executor.map(
+                    process_file_in_worker,
+                    args.inputs,
+                    [args] * len(args.inputs),
+                )
+            )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check abundance tables for likely contaminants."
+    )
+    parser.add_argument(
+        "inputs", nargs="+", help="Input CSV files or tables made by ingest.py"
+    )
+    parser.add_argument(
+        "--curated",
+        default="data/curated_species.csv",
+        help="Curated species list (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--fallback-curated",
+        action="append",
+        default=[],
+        help="Curated list consulted, in the order given, for species and values "
+        "missing from --curated; may be repeated",
+    )
+    parser.add_argument(
+        "--weights",
+        default="data/score_weights.txt",
+        help="Score weights JSON file (default: %(default)s)",
+    )
+    parser.add_argument("--score-threshold", type=float, default=1)
+    parser.add_argument("--reads-threshold", type=float, default=1)
+    parser.add_argument(
+        "--output-dir", default="results", help="Directory for result tables"
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(WRITERS),
+        default="csv",
+        help="Format of the result tables; parquet needs pyarrow",
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=None,
+        help="Stream each input in blocks of this many rows to bound memory",
+    )
+    parser.add_argument(
+        "--sparse",
+        action="store_true",
+        help="Hold location counts as a sparse matrix (for mostly-zero inputs)",
+    )
+    parser.add_argument(
+        "--loose-matching",
+        action="store_true",
+        help="Also match names differing in case, spacing, strain suffix or spelling",
+    )
+    parser.add_argument(
+        "--score-bound",
+        choices=["min", "max"],
+        default=None,
+        help="Score species with unknown curated values at their lowest or "
+        "highest possible score instead of leaving them out",
+    )
+    parser.add_argument(
+        "--burden",
+        action="store_true",
+        help="Write <name>_burden with reads and score-weighted reads per location",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Write <name>_profile.json with time, rows and peak memory per stage",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=0,
+        help="Worker processes (default: one per core)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    module = missing_module(args.format)
+    if module is not None:
+        print(
+            f"Error: --format {args.format} needs {module}, which is not installed.",
+            file=sys.stderr,
+        )
+        return 1
+    if args.fallback_curated:
+        curated_store = load_overlay([args.curated] + args.fallback_curated)
+    else:
+        curated_store = load_curated(args.curated)
+    score_weights = load_score_weights(args.weights)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    summary = pd.DataFrame(run_batch(curated_store, score_weights, args))
+    elapsed = time.perf_counter() - start
+
+    summary = summary.rename(columns={"input": "Input"})
+    # Counts stay whole numbers next to failed inputs' empty ones
+    counts = ["Num", "Matched", "Above Threshold"]
+    summary[counts] = summary[counts].astype("Int64")
+    summary.to_csv(os.path.join(args.output_dir, "summary.csv"), index=False)
+    print(summary.to_string(index=False))
+    print(
+        f"Processed {len(summary)} files in {elapsed:.2f} s "
+        f"({len(summary) / elapsed:.1f} files/sec)"
+    )
+    failed = int(summary["Error"].notna().sum())
+    if failed:
+        print(f"{failed} of {len(summary)} files failed", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,471 @@
+import argparse
+import ast
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from checkContamination import ContaminationChecker
+from count_matrix import CountMatrix
+from curated_store import load_curated, load_score_weights
+
+# In the order precompute and apply_thresholds profile them
+STAGES = (
+    "matching",
+    "scoring",
+    "location counting",
+    "thresholds",
+    "locations",
+    "reverse table",
+    "venn subsets",
+)
+SCALE_KEYS = ("species", "locations", "density", "match fraction")
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+# Only needed to draw the Venn diagram, so never imported at startup
+PLOTTING_MODULES = ("matplotlib", "matplotlib_venn")
+
+
+def make_counts(num_species, num_locations, density, seed=0):
+    """Random location counts where about `density` of the cells are non-zero.
+
+    Non-zero reads are log-normal, so most are small with a long tail of
+    abundant species, as in real abundance tables.
+    """
+    rng = np.random.default_rng(seed)
+    counts = np.ceil(rng.lognormal(3, 2, size=(num_species, num_locations)))
+    counts = np.minimum(counts, 10**7).astype(np.int64)
+    counts[rng.random((num_species, num_locations)) >= density] = 0
+    return pd.DataFrame(counts, columns=[f"loc{i}" for i in range(num_locations)])
+
+
+def make_input(
+    curated_species, num_species, num_locations, density, match_fraction, seed=0
+):
+    """Synthetic abundance table in the app's input format.
+
+    About match_fraction of the rows name a species from curated_species
+    (drawn with replacement); the rest get made-up names no list contains.
+    """
+    rng = np.random.default_rng(seed)
+    curated_species = pd.unique(pd.Series(curated_species, dtype=object))
+    names = np.array(
+        [f"Synthetic bacterium {i}" for i in range(num_species)], dtype=object
+    )
+    hits = rng.random(num_species) < match_fraction
+    if len(curated_species):
+        names[hits] = rng.choice(curated_species, hits.sum())
+    table = make_counts(num_species, num_locations, density, seed)
+    table.insert(0, "#Datasets", names)
+    return table
+
+
+def time_stages(checker, input_df, score_weights, score_threshold, reads_threshold):
+    """Seconds spent in each stage of filter_bacteria on one input.
+
+    The pipeline stages are read from the checker's own profile of a
+    precompute and apply_thresholds run; only the Venn and UpSet subsets,
+    which the app works out afterwards, are timed here.
+    """
+    sweep = checker.precompute(input_df, score_weights)
+    _, filtered_bacteria, thresh_rows, _ = checker.apply_thresholds(
+        sweep, score_threshold, reads_threshold
+    )
+    timings = {
+        stage: record["seconds"] for stage, record in checker.profile.stages.items()
+    }
+
+    start = time.perf_counter()
+    if thresh_rows:
+        properties = checker.get_unique_properties(filtered_bacteria)
+        checker.property_intersections(filtered_bacteria)
+        if len(properties) >= 2:
+            checker.venn_regions(filtered_bacteria, properties[:3])
+    timings["venn subsets"] = time.perf_counter() - start
+    return timings, {"matched": sweep.matching_rows, "above threshold": thresh_rows}
+
+
+def stage_benchmark(
+    checker,
+    curated_species,
+    score_weights,
+    scales,
+    score_threshold=1,
+    reads_threshold=1,
+    repeats=3,
+):
+    """Time every stage at every scale; the best of `repeats` runs is kept.
+
+    scales is an iterable of (species, locations, density, match_fraction).
+    Returns one record per scale and stage.
+    """
+    records = []
+    for num_species, num_locations, density, match_fraction in scales:
+        input_df = make_input(
+            curated_species, num_species, num_locations, density, match_fraction
+        )
+        runs = [
+            time_stages(
+                checker, input_df, score_weights, score_threshold, reads_threshold
+            )
+            for _ in range(repeats)
+        ]
+        counts = runs[0][1]
+        for stage in STAGES:
+            records.append(
+                {
+                    "species": num_species,
+                    "locations": num_locations,
+                    "density": density,
+                    "match fraction": match_fraction,
+                    "stage": stage,
+                    # Stages after "thresholds" are skipped when no row passes
+                    "seconds": min(timings.get(stage, 0.0) for timings, _ in runs),
+                    **counts,
+                }
+            )
+    return records
+
+
+def check_budgets(records, budgets):
+    """Records whose time exceeds the budget for their stage, in seconds.
+
+    budgets maps a stage name, or "total" for the sum over stages at one
+    scale, to the most seconds allowed.
+    """
+    over = []
+    totals = {}
+    for record in records:
+        scale = tuple(record[key] for key in SCALE_KEYS)
+        totals[scale] = totals.get(scale, 0) + record["seconds"]
+        budget = budgets.get(record["stage"])
+        if budget is not None and record["seconds"] > budget:
+            over.append({**record, "budget": budget})
+    budget = budgets.get("total")
+    for scale, seconds in totals.items():
+        if budget is not None and seconds > budget:
+            over.append(
+                {
+                    **dict(zip(SCALE_KEYS, scale)),
+                    "stage": "total",
+                    "seconds": seconds,
+                    "budget": budget,
+                }
+            )
+    return over
+
+
+def time_count_matrix(frame, sparse, reads_thresholds):
+    """Seconds to build a CountMatrix and answer every reads threshold."""
+    start = time.perf_counter()
+    count_matrix = CountMatrix.from_frame(frame, sparse)
+    rows = np.arange(frame.shape[0])
+    for reads_threshold in reads_thresholds:
+        count_matrix.num_loc(reads_threshold)
+        count_matrix.location_hits(rows, frame.index, reads_threshold)
+    elapsed = time.perf_counter() - start
+
+    if sparse:
+        nbytes = sum(
+            a.nbytes
+            for a in (count_matrix.indptr, count_matrix.indices, count_matrix.data)
+        )
+    else:
+        nbytes = count_matrix.dense.nbytes
+    return elapsed, nbytes + count_matrix.sorted_ranks.nbytes
+
+
+def sparse_crossover(num_species, num_locations, densities, reads_thresholds):
+    """Compare dense and sparse counts over densities; find the crossover."""
+    rows = []
+    for density in densities:
+        frame = make_counts(num_species, num_locations, density)
+        dense_time, dense_bytes = time_count_matrix(frame, False, reads_thresholds)
+        sparse_time, sparse_bytes = time_count_matrix(frame, True, reads_thresholds)
+        rows.append(
+            {
+                "density": density,
+                "dense s": dense_time,
+                "sparse s": sparse_time,
+                "dense MB": dense_bytes / 1e6,
+                "sparse MB": sparse_bytes / 1e6,
+            }
+        )
+    results = pd.DataFrame(rows)
+    slower = results[results["sparse s"] >= results["dense s"]]
+    crossover = slower["density"].min() if not slower.empty else None
+    return results, crossover
+
+
+def top_level_imports(path):
+    """Modules imported by the top-level statements of a source file."""
+    with open(path, "r") as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            names = [node.module]
+        else:
+            continue
+        modules.extend(name for name in names if name not in modules)
+    return modules
+
+
+def pulls_in_streamlit(module, directory, seen=None):
+    """Whether importing a module imports Streamlit.
+
+    Only the app's own modules in directory are followed; any other
+    package is taken not to need Streamlit.
+    """
+    if module.split(".")[0] == "streamlit":
+        return True
+    path = os.path.join(directory, module.replace(".", os.sep) + ".py")
+    seen = set() if seen is None else seen
+    if module in seen or not os.path.isfile(path):
+        return False
+    seen.add(module)
+    return any(
+        pulls_in_streamlit(name, directory, seen) for name in top_level_imports(path)
+    )
+
+
+def app_modules(path=APP_PATH):
+    """What the app imports at startup, besides Streamlit.
+
+    Read from the app's top-level import statements, so it stays in step
+    with the app; imports inside functions are left out, as they are not
+    paid at startup. The app's own modules that import Streamlit, such as
+    display_utils, are left out too, or Streamlit would be timed with them.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    return [
+        module
+        for module in top_level_imports(path)
+        if not pulls_in_streamlit(module, directory)
+    ]
+
+
+def import_times(modules):
+    """Import modules in a fresh interpreter, as a cold start would.
+
+    Returns the seconds spent importing each top-level package, counting
+    only its own modules (not the packages they import in turn), and so
+    summing to the total import time.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    seconds = {}
+    # Lines are "import time: self [us] | cumulative | module"
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, _, name = line[len("import time:") :].split("|")
+        package = name.strip().split(".")[0]
+        seconds[package] = seconds.get(package, 0) + int(own) / 1e6
+    return seconds
+
+
+def run_imports(args):
+    if args.modules is None:
+        args.modules = app_modules()
+    try:
+        runs = [import_times(args.modules) for _ in range(args.repeats)]
+    except subprocess.CalledProcessError as error:
+        # Drop the timings and show only why the import failed
+        lines = error.stderr.splitlines()
+        print(
+            "\n".join(line for line in lines if not line.startswith("import time:")),
+            file=sys.stderr,
+        )
+        return 1
+    # The first run pays for a cold disk cache; keep the fastest
+    seconds = min(runs, key=lambda run: sum(run.values()))
+    total = sum(seconds.values())
+    results = pd.Series(seconds, name="seconds").sort_values(ascending=False)
+    print(results.head(args.top).to_string(float_format="%.4f"))
+    print(f"Total: {total:.4f} s for {', '.join(args.modules)}")
+
+    status = 0
+    eager = sorted(set(seconds).intersection(PLOTTING_MODULES))
+    if eager:
+        print(f"Imported at startup: {', '.join(eager)}", file=sys.stderr)
+        status = 1
+    if args.budget is not None and total > args.budget:
+        print(
+            f"Over budget: imports took {total:.4f} s (budget {args.budget} s)",
+            file=sys.stderr,
+        )
+        status = 1
+    return status
+
+
+def run_stages(args):
+    curated_species = []
+    curated_store = None
+    for path in args.curated:
+        store = load_curated(path)
+        curated_species.extend(store.curated_df["Species"].dropna())
+        curated_store = curated_store or store
+    score_weights = load_score_weights(args.weights)
+    checker = ContaminationChecker(
+        curated_store.curated_df,
+        score_weights,
+        curated_store,
+        args.sparse,
+        loose_matching=args.loose_matching,
+        score_bound=args.score_bound,
+    )
+
+    scales = itertools.product(
+        args.species, args.locations, args.densities, args.match_fractions
+    )
+    records = stage_benchmark(
+        checker,
+        curated_species,
+        score_weights,
+        scales,
+        args.score_threshold,
+        args.reads_threshold,
+        args.repeats,
+    )
+    results = pd.DataFrame(records)
+    print(results.to_string(index=False, float_format="%.4f"))
+
+    over = []
+    if args.budgets:
+        with open(args.budgets, "r") as f:
+            over = check_budgets(records, json.load(f))
+        for record in over:
+            print(
+                f"Over budget: {record['stage']} took {record['seconds']:.4f} s "
+                f"(budget {record['budget']} s) at {record['species']} species x "
+                f"{record['locations']} locations",
+                file=sys.stderr,
+            )
+
+    if args.output:
+        config = {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("func", "output", "budgets")
+        }
+        with open(args.output, "w") as f:
+            json.dump(
+                {"config": config, "results": records, "over budget": over},
+                f,
+                indent=2,
+            )
+    return 1 if over else 0
+
+
+def run_sparse(args):
+    results, crossover = sparse_crossover(
+        args.species, args.locations, args.densities, [1, 10, 100, 1000, 10000]
+    )
+    print(results.to_string(index=False, float_format="%.4f"))
+    if crossover is None:
+        print("Sparse was faster at every density tried.")
+    else:
+        print(f"Dense is as fast or faster from density {crossover} up.")
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the contamination check.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    stages = commands.add_parser(
+        "stages", help="Time each stage of filter_bacteria on synthetic inputs"
+    )
+    stages.add_argument("--species", type=int, nargs="+", default=[1000, 10000])
+    stages.add_argument("--locations", type=int, nargs="+", default=[50])
+    stages.add_argument("--densities", type=float, nargs="+", default=[0.1])
+    stages.add_argument(
+        "--match-fractions",
+        type=float,
+        nargs="+",
+        default=[0.3],
+        help="Fraction of species names taken from the curated lists",
+    )
+    stages.add_argument(
+        "--curated",
+        nargs="+",
+        default=["data/curated_species.csv", "data/semicurated.csv"],
+        help="Curated lists to draw names from; the first is checked against",
+    )
+    stages.add_argument("--weights", default="data/score_weights.txt")
+    stages.add_argument("--score-threshold", type=float, default=1)
+    stages.add_argument("--reads-threshold", type=float, default=1)
+    stages.add_argument("--sparse", action="store_true")
+    stages.add_argument(
+        "--loose-matching",
+        action="store_true",
+        help="Match names by normalized form, genus and species, and similarity",
+    )
+    stages.add_argument(
+        "--score-bound",
+        choices=["min", "max"],
+        default=None,
+        help="Score species with unknown curated values at their lowest or "
+        "highest possible score",
+    )
+    stages.add_argument("--repeats", type=int, default=3)
+    stages.add_argument("--output", help="Write the results as JSON to this file")
+    stages.add_argument(
+        "--budgets",
+        help="JSON file of most seconds per stage (or 'total'); exit 1 if exceeded",
+    )
+    stages.set_defaults(func=run_stages)
+
+    sparse = commands.add_parser(
+        "sparse", help="Time sparse versus dense location counts"
+    )
+    sparse.add_argument("--species", type=int, default=20000)
+    sparse.add_argument("--locations", type=int, default=200)
+    sparse.add_argument(
+        "--densities",
+        type=float,
+        nargs="+",
+        default=[0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.4, 0.8, 1.0],
+    )
+    sparse.set_defaults(func=run_sparse)
+
+    imports = commands.add_parser(
+        "imports", help="Time importing the app's modules in a fresh interpreter"
+    )
+    imports.add_argument(
+        "--modules",
+        nargs="+",
+        default=None,
+        help="Modules to import (default: the app's top-level imports)",
+    )
+    imports.add_argument("--repeats", type=int, default=3)
+    imports.add_argument(
+        "--top", type=int, default=10, help="Number of slowest packages to list"
+    )
+    imports.add_argument(
+        "--budget",
+        type=float,
+        help="Most seconds allowed for all imports; exit 1 if exceeded",
+    )
+    imports.set_defaults(func=run_imports)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,38 +1,356 @@
-import matplotlib.pyplot as plt
+import copy
+
 import numpy as np
 import pandas as pd
-import streamlit as st
-from matplotlib_venn import venn2, venn3
+from count_matrix import CountMatrix, LocationHits
+from curated_store import CuratedStore
+from profiling import PipelineProfile
+
+# Contributing properties are packed into int64 bitmasks
+MAX_MASK_PROPERTIES = 63
+
+# How species with unknown curated values are scored: dropped as before, or
+# at the lowest or highest score their unknown values allow
+SCORE_BOUNDS = (None, "min", "max")
+
+# Attributes set by a run that later display calls rely on
+RESULT_STATE = (
+    "diagnostics",
+    "species_column_name",
+    "mask_properties",
+    "non_matching_rows_df",
+    "non_matching_rows",
+    "location_hits",
+    "profile",
+)
+
+
+def property_bits(num_properties):
+    """Bit values for properties 0..num_properties-1 of a property mask."""
+    return np.left_shift(1, np.arange(num_properties, dtype=np.int64))
+
+
+class ThresholdSweep:
+    """Threshold-independent results for one input table and weight set.
+
+    Scores and contributing properties are computed once and the location
+    counts are held in a CountMatrix, so any threshold combination is a
+    cheap mask. The gathered curated values of the matched species are kept
+    too, so new weights can be applied without matching again.
+    """
+
+    def __init__(
+        self,
+        input_df,
+        matched,
+        count_matrix,
+        count_rows,
+        score_weights,
+        property_names,
+        gathered,
+        scores,
+        property_masks,
+        non_matching_rows_df,
+        diagnostics=(),
+        input_counts=None,
+        profile=None,
+        name_matches=None,
+        intervals=None,
+    ):
+        self.input_df = input_df
+        self.species_df = input_df.iloc[matched, :1]
+        self.count_matrix = count_matrix
+        self.location_columns = count_matrix.columns
+        # Positions of the matched rows in count_matrix
+        self.count_rows = count_rows
+        self.row_max = count_matrix.row_max[count_rows]
+        # Full-input counts, if given, shared with sweeps for other curated lists
+        self.input_counts = input_counts
+        self.score_weights = dict(score_weights)
+        self.property_names = property_names
+        # Curated values, their dtype and which matched species have them
+        self.property_values, self.value_dtype, self.found = gathered
+        self.scores = scores
+        self.property_masks = property_masks
+        # With a score bound: the "unknown" values, property "upper" values,
+        # "min" and "max" scores and "unknown masks", see score_intervals
+        self.intervals = intervals
+        self.non_matching_rows_df = non_matching_rows_df
+        self.matching_rows = self.species_df.shape[0]
+        self.diagnostics = list(diagnostics)
+        # Curated match, match type and confidence per matched row, when
+        # names were matched loosely
+        self.name_matches = name_matches
+        # How the sweep was computed; thresholding adds to a copy
+        self.profile = profile if profile is not None else PipelineProfile()
+
+    def num_loc(self, reads_threshold):
+        """Number of locations per row with reads >= reads_threshold."""
+        return self.count_matrix.num_loc(reads_threshold, self.count_rows)
+
+    def threshold_grid(self, score_thresholds, reads_thresholds):
+        """Rows above threshold for every score x reads threshold pair."""
+        above_score = self.scores[:, None] >= np.asarray(score_thresholds)
+        above_reads = self.row_max[:, None] >= np.asarray(reads_thresholds)
+        grid = above_score.astype(np.int64).T @ above_reads.astype(np.int64)
+        return pd.DataFrame(
+            grid,
+            index=pd.Index(score_thresholds, name="Score Threshold"),
+            columns=pd.Index(reads_thresholds, name="Reads Threshold"),
+        )
 
 
 class ContaminationChecker:
     """Class to perform contamination checks and filtering on bacteria data."""
 
-    def __init__(self, curated_df, score_weights):
+    def __init__(
+        self,
+        curated_df,
+        score_weights,
+        curated_store=None,
+        sparse_counts=False,
+        trace_memory=False,
+        loose_matching=False,
+        score_bound=None,
+    ):
+        if score_bound not in SCORE_BOUNDS:
+            raise ValueError(f"score_bound must be one of {SCORE_BOUNDS}.")
         self.curated_df = curated_df
         self.default_score_weights = score_weights
+        # Hold location counts in CSR form; pays off for mostly-zero tables
+        self.sparse_counts = sparse_counts
+        if curated_store is None:
+            curated_store = CuratedStore(curated_df)
+        self.curated_store = curated_store
+        self.diagnostics = []
+        # Property names for the bits of "Property Mask", from the last run
+        self.mask_properties = []
+        # Also match input names that differ from curated ones in case,
+        # spacing, strain suffix or spelling
+        self.loose_matching = loose_matching
+        # Score species with unknown values at the "min" or "max" score they
+        # can have rather than dropping them
+        self.score_bound = score_bound
+        # Per-stage timings of the last run; trace_memory adds peak memory
+        self.trace_memory = trace_memory
+        # Called at the start and end of every stage, see PipelineProfile
+        self.stage_listener = None
+        self.profile = PipelineProfile(trace_memory)
+
+    def add_diagnostic(self, level, message):
+        """Record a warning or info message for the caller to report."""
+        self.diagnostics.append({"level": level, "message": message})
+
+    def new_profile(self):
+        return PipelineProfile(self.trace_memory, self.stage_listener)
+
+    def result_state(self):
+        """Attributes that describe the last result, to cache alongside it."""
+        state = {name: getattr(self, name, None) for name in RESULT_STATE}
+        state["profile"] = self.profile.copy()
+        return state
+
+    def restore_result_state(self, state):
+        """Put back attributes saved with result_state()."""
+        for name, value in state.items():
+            if name == "profile":
+                # Stages added later, e.g. by add_locations, stay out of state
+                value = value.copy() if value is not None else PipelineProfile()
+            setattr(self, name, value)
+
+    def lookup_species(self, species):
+        """Return the curated row for each species name, or -1 if not curated."""
+        return self.curated_store.lookup_species(species)
+
+    def gather_properties(self, species, properties):
+        """Curated values of properties for many species, gathered once.
+
+        Returns the values of the curated species, their dtype, and which
+        species were found. Values are None for a curated list with
+        non-numeric property columns.
+        """
+        if len(properties) > MAX_MASK_PROPERTIES:
+            raise ValueError(
+                f"At most {MAX_MASK_PROPERTIES} weighted properties are supported."
+            )
+        values, dtype = self.curated_store.property_matrix(properties)
+        if not np.issubdtype(dtype, np.number):
+            self.add_diagnostic(
+                "warning", "Non-numeric values detected in curated properties."
+            )
+            return None, dtype, np.zeros(len(species), dtype=bool)
+
+        rows = self.lookup_species(species)
+        found = rows >= 0
+        return values[rows[found]], dtype, found
+
+    def score_values(self, values, dtype, found, weights):
+        """Scores and property masks from gather_properties() output."""
+        num_species = len(found)
+        if values is None:
+            return np.zeros(num_species, dtype=int), np.zeros(
+                num_species, dtype=np.int64
+            )
+
+        weights = np.asarray(weights)
+        scores = np.zeros(num_species, dtype=np.result_type(dtype, weights))
+        scores[found] = values @ weights
+        contributing = (values * weights) > 0
+
+        property_masks = np.zeros(num_species, dtype=np.int64)
+        property_masks[found] = contributing @ property_bits(len(weights))
+
+        return scores, property_masks
+
+    def gather_intervals(self, species, properties):
+        """gather_properties for interval scores, with unknown values marked.
+
+        Returns gather_properties-style (values, dtype, found), with 0 for
+        unknown values, and a dict with the "unknown" mask of the found
+        species and the "upper" value of each property. Non-numeric values
+        are unknown rather than making every score 0.
+        """
+        if len(properties) > MAX_MASK_PROPERTIES:
+            raise ValueError(
+                f"At most {MAX_MASK_PROPERTIES} weighted properties are supported."
+            )
+        values, unknown, upper = self.curated_store.tristate_matrix(properties)
+        dtype = np.dtype(np.float64)
+        if np.array_equal(values, np.rint(values)):
+            values, dtype = values.astype(np.int64), np.dtype(np.int64)
+
+        rows = self.lookup_species(species)
+        found = rows >= 0
+        intervals = {"unknown": unknown[rows[found]], "upper": upper}
+        return (values[rows[found]], dtype, found), intervals
+
+    def score_intervals(self, values, dtype, found, intervals, weights):
+        """Lowest and highest possible scores from gather_intervals() output.
+
+        An unknown value may be anything from 0 to its property's upper
+        value, adding between min(0, weight x upper) and max(0, weight x
+        upper). Both bounds come from one product of the known values and
+        the unknown mask with a two-column weight matrix. Returns the
+        score_bound scores, the property masks of the known contributing
+        properties and intervals with "min" and "max" scores and "unknown
+        masks", the weighted properties each species has no value for.
+        """
+        weights = np.asarray(weights)
+        unknown, upper = intervals["unknown"], intervals["upper"]
+        reach = weights * upper
+        bound_weights = np.vstack(
+            (
+                np.column_stack((weights, weights)),
+                np.column_stack((np.minimum(reach, 0), np.maximum(reach, 0))),
+            )
+        )
+        bounds = np.zeros((len(found), 2), dtype=np.result_type(dtype, weights))
+        bounds[found] = np.hstack((values, unknown)) @ bound_weights
+
+        bits = property_bits(len(weights))
+        property_masks = np.zeros(len(found), dtype=np.int64)
+        property_masks[found] = ((values * weights) > 0) @ bits
+        unknown_masks = np.zeros(len(found), dtype=np.int64)
+        unknown_masks[found] = (unknown & (weights != 0)) @ bits
+
+        intervals = dict(intervals)
+        intervals["min"], intervals["max"] = bounds[:, 0], bounds[:, 1]
+        intervals["unknown masks"] = unknown_masks
+        return intervals[self.score_bound], property_masks, intervals
+
+    def score_species(self, species, properties, weights):
+        """Compute weight scores and contributing properties for many species.
+
+        The curated property matrix is gathered once for all species and the
+        scores come from a single matrix-vector product with the weights.
+        Contributing properties come back as bitmasks, bit i standing for
+        properties[i]. Species that are not curated, or a curated list with
+        non-numeric property columns, score 0 with no contributing properties.
+        """
+        values, dtype, found = self.gather_properties(species, properties)
+        return self.score_values(values, dtype, found, weights)
+
+    def add_locations(self, filtered_bacteria):
+        """Return filtered rows with their "Locations" dicts from the last run."""
+        with self.profile.stage("locations", len(filtered_bacteria)) as rows:
+            filtered_bacteria = filtered_bacteria.copy()
+            filtered_bacteria["Locations"] = self.location_hits.locations(
+                filtered_bacteria.index
+            )
+            rows["rows out"] = len(filtered_bacteria)
+        return filtered_bacteria
 
     def flatten_set_of_lists(self, set_of_lists):
         flattened_list = [item for sublist in set_of_lists for item in sublist]
         return set(flattened_list)
 
+    def decode_properties(self, property_masks, names=None):
+        """Contributing property lists for an array of property bitmasks.
+
+        names are the names of the bits, by default mask_properties.
+        """
+        if names is None:
+            names = self.mask_properties
+        names = np.array(names, dtype=object)
+        combos, inverse = np.unique(property_masks, return_inverse=True)
+        membership = (combos[:, None] & property_bits(len(names))) != 0
+        combo_names = [list(names[row]) for row in membership]
+        return [list(combo_names[i]) for i in inverse.ravel()]
+
+    def property_membership(self, filtered_bacteria):
+        """Boolean rows x mask_properties matrix of contributing properties."""
+        property_masks = filtered_bacteria["Property Mask"].to_numpy(dtype=np.int64)
+        return (property_masks[:, None] & property_bits(len(self.mask_properties))) != 0
+
     def get_unique_properties(self, filtered_bacteria):
-        # Get unique properties from the 'Contributing Properties' column
-        all_properties = self.flatten_set_of_lists(
-            filtered_bacteria["Contributing Properties"].dropna()
+        # Properties contributing for at least one row, sorted by name
+        present = self.property_membership(filtered_bacteria).any(axis=0)
+        return sorted(
+            prop for prop, found in zip(self.mask_properties, present) if found
         )
 
-        # Check if the set is empty and print debug information if it is
-        if not all_properties:
-            print("Debug: all_properties set is empty")
-            print("Sample of 'Contributing Properties' column:")
-            print(filtered_bacteria["Contributing Properties"].head())
+    def property_intersections(self, filtered_bacteria):
+        """UpSet-style summary of every combination of contributing properties.
 
-        # Get all properties
-        return list(all_properties)
+        One row per combination present, with a True/False column for each
+        weighted property, "Degree" (how many properties) and "Number" (how
+        many species have exactly that combination), largest first.
+        """
+        property_masks = filtered_bacteria["Property Mask"].to_numpy(dtype=np.int64)
+        combos, counts = np.unique(property_masks, return_counts=True)
+        membership = (combos[:, None] & property_bits(len(self.mask_properties))) != 0
+        table = pd.DataFrame(membership, columns=self.mask_properties)
+        table["Degree"] = membership.sum(axis=1)
+        table["Number"] = counts
+        return table.sort_values("Number", ascending=False, kind="stable").reset_index(
+            drop=True
+        )
+
+    def intersection_size(self, filtered_bacteria, properties):
+        """Number of species whose contributing properties include all given."""
+        property_masks = filtered_bacteria["Property Mask"].to_numpy(dtype=np.int64)
+        wanted = 0
+        for prop in properties:
+            wanted |= 1 << self.mask_properties.index(prop)
+        return int(((property_masks & wanted) == wanted).sum())
+
+    def venn_regions(self, filtered_bacteria, properties):
+        """Exclusive region sizes for a 2- or 3-set Venn diagram.
+
+        Ordered as matplotlib_venn expects: (Ab, aB, AB) for two properties,
+        (Abc, aBc, ABc, abC, AbC, aBC, ABC) for three.
+        """
+        membership = self.property_membership(filtered_bacteria)
+        columns = [self.mask_properties.index(prop) for prop in properties]
+        codes = membership[:, columns] @ (1 << np.arange(len(columns)))
+        return tuple(np.bincount(codes, minlength=2 ** len(columns))[1:].tolist())
 
     def generate_venn_diagram(self, filtered_bacteria):
         """Generate a Venn diagram of contributing properties."""
+        # UI and plotting libraries are only needed here
+        import matplotlib.pyplot as plt
+        import streamlit as st
+        from matplotlib_venn import venn2, venn3
 
         properties = self.get_unique_properties(filtered_bacteria)
         num_properties = len(properties)
@@ -41,26 +359,13 @@ class ContaminationChecker:
             st.write("No contributing properties found.")
             return None
         elif num_properties == 1:
-            count = sum(
-                properties[0] in item
-                for item in filtered_bacteria["Contributing Properties"]
-                if isinstance(item, list)
-            )
+            count = self.intersection_size(filtered_bacteria, properties)
             st.write(
                 f"Only one property found: {properties[0]}. {count} bacteria belong to this property."
             )
             return None
         elif num_properties == 2:
-            subsets = [
-                set(
-                    filtered_bacteria[
-                        filtered_bacteria["Contributing Properties"].apply(
-                            lambda x: prop in x
-                        )
-                    ].index
-                )
-                for prop in properties
-            ]
+            subsets = self.venn_regions(filtered_bacteria, properties)
             plt.figure(figsize=(4, 4))
             venn2(subsets=subsets, set_labels=properties)
         else:
@@ -81,29 +386,11 @@ class ContaminationChecker:
                     st.warning("Please select distinct properties.")
                     return None
 
-                subsets = [
-                    set(
-                        filtered_bacteria[
-                            filtered_bacteria["Contributing Properties"].apply(
-                                lambda x: prop in x
-                            )
-                        ].index
-                    )
-                    for prop in [prop1, prop2]
-                ]
+                subsets = self.venn_regions(filtered_bacteria, [prop1, prop2])
                 plt.figure(figsize=(4, 4))
                 venn2(subsets=subsets, set_labels=[prop1, prop2])
             else:
-                subsets = [
-                    set(
-                        filtered_bacteria[
-                            filtered_bacteria["Contributing Properties"].apply(
-                                lambda x: prop in x
-                            )
-                        ].index
-                    )
-                    for prop in [prop1, prop2, prop3]
-                ]
+                subsets = self.venn_regions(filtered_bacteria, [prop1, prop2, prop3])
                 plt.figure(figsize=(4, 4))
                 venn3(subsets=subsets, set_labels=[prop1, prop2, prop3])
 
@@ -112,38 +399,61 @@ class ContaminationChecker:
 
         return plt.gcf()  # Return the current figure
 
-    def filter_bacteria(
-        self,
-        input_df,
-        score_weights,
-        score_threshold,
-        reads_threshold,
-    ):
-        """Filter bacteria based on thresholds and weights."""
+    def input_counts(self, input_df):
+        """CountMatrix over every row of an input, to share between sweeps."""
+        return CountMatrix.from_frame(input_df.iloc[:, 1:], self.sparse_counts)
+
+    def match_names(self, species, suggest=False):
+        """Curated match, "Match Type" and "Confidence" for each input name.
+
+        See NameIndex.resolve; names are tried exactly, normalized, by genus
+        and species, then by spelling. suggest also returns looser, less
+        likely matches, for a person to check.
+        """
+        if suggest:
+            return self.curated_store.name_index.resolve(
+                species, min_similarity=0.5, max_edit_rate=None
+            )
+        return self.curated_store.name_index.resolve(species)
+
+    def match_species(self, input_df, score_weights):
+        """Find the input rows to score and the weighted curated properties.
+
+        Returns a boolean mask of matched rows, the rows whose species are
+        not curated at all, the weighted properties present in the curated
+        list, and the curated name each row matched. With loose_matching
+        the last is a match_names() frame; otherwise it is None and only
+        exact names match.
+        """
         # Determine if bacteria species exist in the curated list
         species_column = input_df.columns[0]  # Assuming the species column is first
         self.species_column_name = species_column  # Save the column name
+        name_matches = None
+        species = input_df[species_column]
+        if self.loose_matching:
+            name_matches = self.match_names(species)
+            species = name_matches["Match"]
+        matched = np.zeros(input_df.shape[0], dtype=bool)  # Unless weights select rows
         if any(score_weights.values()):
             # Check if the columns indicated by score_weights.keys() exist in the curated file
             valid_columns = [
                 col for col in score_weights.keys() if col in self.curated_df.columns
             ]
             if valid_columns:
-                # Filter rows where at least one valid column is not None
-                valid_rows = self.curated_df[
-                    self.curated_df[valid_columns].notna().any(axis=1)
-                ]
-                matching_rows_df = input_df[
-                    input_df[species_column].isin(valid_rows["Species"])
-                ]
+                if self.score_bound is not None:
+                    # Species with no known value still have a score range
+                    valid_rows = self.curated_df
+                else:
+                    # Filter rows where at least one valid column is not None
+                    valid_rows = self.curated_df[
+                        self.curated_df[valid_columns].notna().any(axis=1)
+                    ]
+                matched = species.isin(valid_rows["Species"]).to_numpy()
             else:
-                st.warning(
-                    "No valid columns found in the curated file for the given score weights."
+                self.add_diagnostic(
+                    "warning",
+                    "No valid columns found in the curated file for the given score weights.",
                 )
-                matching_rows_df = pd.DataFrame()  # Empty DataFrame if no valid columns
-        else:
-            matching_rows_df = pd.DataFrame()  # Empty DataFrame if no weights
-        matching_rows = matching_rows_df.shape[0]
         # curated_matching_rows = self.curated_df[
         #    self.curated_df["Species"].isin(matching_rows_df[species_column])
         # ]
@@ -154,38 +464,8 @@ class ContaminationChecker:
 
         # Identify rows not in curated set
         non_matching_rows_df = input_df[
-            ~input_df[species_column].isin(self.curated_df["Species"])
+            ~species.isin(self.curated_df["Species"]).to_numpy()
         ]
-        non_matching_rows = non_matching_rows_df.shape[0]
-
-        # Store non-matching rows for later use
-        self.non_matching_rows_df = non_matching_rows_df
-        self.non_matching_rows = non_matching_rows
-
-        # Determine location columns (all except the first column)
-        location_columns = input_df.columns[1:]
-
-        # Apply reads threshold
-        filtered_df = matching_rows_df.copy()
-        filtered_df["Num loc"] = filtered_df[location_columns].apply(
-            lambda x: x[x >= reads_threshold].count(), axis=1
-        )
-        filtered_df["Locations"] = filtered_df[location_columns].apply(
-            lambda x: {
-                loc: count for loc, count in x.items() if count > reads_threshold
-            },
-            axis=1,
-        )
-
-        # Keep rows where location count exceeds threshold
-        filtered_df = filtered_df[filtered_df["Num loc"] > 0]
-
-        # Check if the filtered DataFrame is empty
-        if filtered_df.empty:
-            # Handle the case where no rows meet the threshold
-            print("Warning: No bacteria species meet the location count threshold.")
-            # For Streamlit, it's better to return early with empty results
-            return 0, 0, 0, 0
 
         properties = list(score_weights.keys())
         curated_columns = set(self.curated_df.columns)
@@ -193,79 +473,570 @@ class ContaminationChecker:
             prop for prop in properties if prop not in curated_columns
         ]
         if missing_properties:
-            st.info(
-                f"Warning: Properties missing from the curated dataset: {', '.join(missing_properties)}"
+            self.add_diagnostic(
+                "info",
+                f"Warning: Properties missing from the curated dataset: {', '.join(missing_properties)}",
             )
         properties = [prop for prop in properties if prop in curated_columns]
+        return matched, non_matching_rows_df, properties, name_matches
+
+    def count_locations(self, input_df, matched, input_counts=None):
+        """CountMatrix holding the matched rows and their positions in it."""
+        if input_counts is not None:
+            return input_counts, np.flatnonzero(matched)
+        # Determine location columns (all except the first column)
+        count_matrix = CountMatrix.from_frame(
+            input_df.iloc[matched, 1:], self.sparse_counts
+        )
+        return count_matrix, np.arange(np.count_nonzero(matched))
+
+    def precompute(self, input_df, score_weights, input_counts=None):
+        """Match and score input species; nothing here depends on thresholds.
+
+        Warnings raised along the way are kept in the returned sweep's
+        diagnostics as {"level", "message"} dicts. input_counts, from
+        input_counts(input_df), lets sweeps for other curated lists or
+        weight keys reuse the location counts; by default only the matched
+        rows' counts are built.
+        """
+        self.diagnostics = []
+        self.profile = profile = self.new_profile()
+        with profile.stage("matching", input_df.shape[0]) as rows:
+            matched, non_matching_rows_df, properties, name_matches = (
+                self.match_species(input_df, score_weights)
+            )
+            rows["rows out"] = np.count_nonzero(matched)
         weights = [score_weights[prop] for prop in properties]
+        if name_matches is not None:
+            name_matches = name_matches[matched]
+            species = name_matches["Match"]
+        else:
+            species = input_df.iloc[:, 0][matched]
 
-        # Apply score threshold based on weights
-        def calculate_score_and_properties(species):
-            species_data = self.curated_df[self.curated_df["Species"] == species]
-            if species_data.empty:
-                return 0, []
-
-            try:
-                values = species_data[properties].values.flatten()
-                if not np.issubdtype(values.dtype, np.number):
-                    raise ValueError("Non-numeric values detected")
-            except ValueError as e:
-                print(f"Warning: {e} for species {species}")
-                return 0, []
-            except Exception as e:
-                print(f"Error processing data for species {species}: {e}")
-                return 0, []
-
-            # Ensure values and weights have the same length
-            min_length = min(len(values), len(weights))
-            weighted_values = values[:min_length] * weights[:min_length]
-            if len(values) != len(weights):
-                print(
-                    f"Warning: Mismatch in length of values ({len(values)}) and\
-                        weights ({len(weights)}) for species {species}"
+        intervals = None
+        with profile.stage("scoring", rows["rows out"]) as rows:
+            if self.score_bound is not None:
+                gathered, intervals = self.gather_intervals(species, properties)
+                scores, property_masks, intervals = self.score_intervals(
+                    *gathered, intervals, weights
                 )
-            total_score = sum(weighted_values)
+            else:
+                gathered = self.gather_properties(species, properties)
+                scores, property_masks = self.score_values(*gathered, weights)
+            rows["rows out"] = np.count_nonzero(gathered[2])
+        self.mask_properties = properties
 
-            contributing_properties = [
-                prop for prop, val in zip(properties, weighted_values) if val > 0
-            ]
+        with profile.stage("location counting", rows["rows in"]) as rows:
+            count_matrix, count_rows = self.count_locations(
+                input_df, matched, input_counts
+            )
+            rows["rows out"] = len(count_rows)
+        return ThresholdSweep(
+            input_df,
+            matched,
+            count_matrix,
+            count_rows,
+            score_weights,
+            properties,
+            gathered,
+            scores,
+            property_masks,
+            non_matching_rows_df,
+            self.diagnostics,
+            input_counts,
+            profile,
+            name_matches,
+            intervals,
+        )
+
+    def update_weights(self, sweep, score_weights):
+        """Rescore a sweep for new weight values without matching again.
 
-            return total_score, contributing_properties
+        Matching and location counts are reused. With integer values and
+        weights each changed weight is a rank-1 update, score += delta x
+        property column, and only that property's mask bit is recomputed;
+        otherwise the kept values are multiplied by the new weights. A change
+        of weight keys, or all weights turning zero, changes which species
+        match, so that falls back to precompute(), as does a change of
+        score_bound.
+        """
+        old_weights = sweep.score_weights
+        if (sweep.intervals is None) != (self.score_bound is None):
+            return self.precompute(sweep.input_df, score_weights, sweep.input_counts)
+        if list(score_weights) != list(old_weights) or bool(
+            any(score_weights.values())
+        ) != bool(any(old_weights.values())):
+            return self.precompute(sweep.input_df, score_weights, sweep.input_counts)
 
-        filtered_df["Weight Score"], filtered_df["Contributing Properties"] = zip(
-            *filtered_df[species_column].apply(calculate_score_and_properties)
+        updated = copy.copy(sweep)
+        updated.score_weights = dict(score_weights)
+        updated.profile = self.profile = self.new_profile()
+        self.diagnostics = list(sweep.diagnostics)
+        self.mask_properties = sweep.property_names
+        if sweep.property_values is None:
+            return updated
+
+        with self.profile.stage("rescoring", sweep.matching_rows) as rows:
+            if sweep.intervals is not None:
+                weights = [score_weights[prop] for prop in sweep.property_names]
+                updated.scores, updated.property_masks, updated.intervals = (
+                    self.score_intervals(
+                        sweep.property_values,
+                        sweep.value_dtype,
+                        sweep.found,
+                        sweep.intervals,
+                        weights,
+                    )
+                )
+            else:
+                updated.scores, updated.property_masks = self.rescore(
+                    sweep, score_weights
+                )
+            rows["rows out"] = sweep.matching_rows
+        return updated
+
+    def rescore(self, sweep, score_weights):
+        """Scores and property masks of a sweep under new weight values."""
+        old_weights = sweep.score_weights
+        values, found = sweep.property_values, sweep.found
+        weights = np.asarray([score_weights[prop] for prop in sweep.property_names])
+        previous = np.asarray([old_weights[prop] for prop in sweep.property_names])
+        score_dtype = np.result_type(sweep.value_dtype, weights)
+        if score_dtype == sweep.scores.dtype and np.issubdtype(score_dtype, np.integer):
+            scores = sweep.scores.copy()
+            property_masks = sweep.property_masks.copy()
+            bits = property_bits(len(weights))
+            for j in np.flatnonzero(weights != previous):
+                scores[found] += (weights[j] - previous[j]) * values[:, j]
+                contributing = (values[:, j] * weights[j]) > 0
+                property_masks[found] = (property_masks[found] & ~bits[j]) | (
+                    contributing * bits[j]
+                )
+        else:
+            scores, property_masks = self.score_values(
+                values, sweep.value_dtype, found, weights
+            )
+        return scores, property_masks
+
+    def select_rows(self, sweep, score_threshold, reads_threshold):
+        """Rows of a sweep passing both thresholds, without "Locations".
+
+        Returns the rows, their LocationHits and the number of rows with at
+        least one location at the reads threshold (before the score cut).
+        """
+        # Keep rows with at least one location at the reads threshold
+        num_loc = sweep.num_loc(reads_threshold)
+        reads_rows = int((num_loc > 0).sum())
+
+        # Apply score threshold based on weights
+        keep = (num_loc > 0) & (sweep.scores >= score_threshold)
+        filtered_bacteria = sweep.species_df[keep].copy()
+        filtered_bacteria["Score"] = sweep.scores[keep]
+        self.mask_properties = sweep.property_names
+        filtered_bacteria["Contributing Properties"] = pd.Series(
+            self.decode_properties(sweep.property_masks[keep]),
+            index=filtered_bacteria.index,
+            dtype=object,
         )
-        filtered_df = filtered_df[filtered_df["Weight Score"] >= score_threshold]
-
-        thresh_rows = filtered_df.shape[0]
-
-        # Rename columns and prepare final output
-        filtered_bacteria = filtered_df[
-            [
-                self.species_column_name,
-                "Weight Score",
-                "Contributing Properties",
-                "Num loc",
-                "Locations",
-            ]
-        ]
-        filtered_bacteria = filtered_bacteria.rename(columns={"Weight Score": "Score"})
+        if sweep.intervals is not None:
+            filtered_bacteria["Min Score"] = sweep.intervals["min"][keep]
+            filtered_bacteria["Max Score"] = sweep.intervals["max"][keep]
+            filtered_bacteria["Unknown Properties"] = pd.Series(
+                self.decode_properties(sweep.intervals["unknown masks"][keep]),
+                index=filtered_bacteria.index,
+                dtype=object,
+            )
+        filtered_bacteria["Num loc"] = num_loc[keep]
+        if sweep.name_matches is not None:
+            matches = sweep.name_matches[keep]
+            filtered_bacteria["Curated Species"] = matches["Match"]
+            filtered_bacteria["Match Type"] = matches["Match Type"]
+            filtered_bacteria["Confidence"] = matches["Confidence"]
+        layer_names = self.curated_store.layer_names
+        if layer_names:
+            # Overlaid curated lists that supplied the weighted values
+            species = filtered_bacteria.get(
+                "Curated Species", filtered_bacteria.iloc[:, 0]
+            )
+            layer_masks = self.curated_store.source_layers(
+                self.lookup_species(species), sweep.property_names
+            )
+            filtered_bacteria["Curated Lists"] = pd.Series(
+                self.decode_properties(layer_masks, layer_names),
+                index=filtered_bacteria.index,
+                dtype=object,
+            )
+        filtered_bacteria["Property Mask"] = sweep.property_masks[keep]
 
-        # Create reverse table: properties and their corresponding bacteria
-        properties = self.get_unique_properties(filtered_bacteria)
+        location_hits = sweep.count_matrix.location_hits(
+            sweep.count_rows[keep], filtered_bacteria.index, reads_threshold
+        )
+        return filtered_bacteria, location_hits, reads_rows
+
+    def location_burden(self, filtered_bacteria):
+        """Contamination burden of each location column over filtered rows.
+
+        Per location: the "Flagged Species" with reads there at the reads
+        threshold, their "Reads", the "Score-Weighted Reads" (reads x
+        score) and, per property, the reads from species contributing it.
+        All come from one product of the rows' reads at the threshold with
+        a matrix of ones, scores and property membership. Uses the location
+        hits of the last run, so rows must come from its filtered table.
+        """
+        with self.profile.stage("location burden", len(filtered_bacteria)) as rows:
+            scores = filtered_bacteria["Score"].to_numpy(dtype=np.float64)
+            weights = np.column_stack(
+                (
+                    np.ones(len(scores)),
+                    scores,
+                    self.property_membership(filtered_bacteria),
+                )
+            )
+            totals, rows_hit = self.location_hits.location_totals(
+                filtered_bacteria.index, weights
+            )
+            # Reads in all and per property; whole reads sum exactly in float64
+            reads = np.delete(totals, 1, axis=1)
+            if self.location_hits.counts.dtype.kind in "iub":
+                reads = np.rint(reads).astype(np.int64)
+            burden = pd.DataFrame(
+                reads[:, 1:],
+                index=pd.Index(self.location_hits.columns, name="Location"),
+                columns=self.mask_properties,
+            )
+            burden.insert(0, "Flagged Species", rows_hit)
+            burden.insert(1, "Reads", reads[:, 0])
+            burden.insert(2, "Score-Weighted Reads", totals[:, 1])
+            rows["rows out"] = len(burden)
+        return burden
+
+    def taxon_codes(self, filtered_bacteria, level):
+        """Code of each filtered row's taxon at level ("genus" or "phylum").
+
+        Codes index curated_store.taxonomy.names[level]; rows are placed by
+        their curated species, so loosely matched names count as the
+        curated one.
+        """
+        if "Curated Species" in filtered_bacteria.columns:
+            species = filtered_bacteria["Curated Species"]
+        else:
+            species = filtered_bacteria[self.species_column_name]
+        rows = self.curated_store.lookup_species(species)
+        return self.curated_store.taxonomy.row_codes(rows, level)
+
+    def taxonomy_rollup(self, filtered_bacteria, level):
+        """Flagged species, reads and scores per genus or phylum.
+
+        Reads are those at the reads threshold, as in "Locations". Each
+        column is one bincount of the scored rows over the taxonomy index's
+        codes, so no group is filtered again. Genus rows also name their
+        phylum. Sorted by score-weighted reads, highest first.
+        """
+        with self.profile.stage(f"{level} rollup", len(filtered_bacteria)) as rows:
+            taxonomy = self.curated_store.taxonomy
+            num_taxa = len(taxonomy.names[level])
+            codes = self.taxon_codes(filtered_bacteria, level)
+            known = codes >= 0
+            codes = codes[known]
+            scores = filtered_bacteria["Score"].to_numpy(dtype=np.float64)[known]
+            reads = self.location_hits.row_totals(filtered_bacteria.index[known])
+
+            def group_sums(weights):
+                return np.bincount(codes, weights=weights, minlength=num_taxa)
+
+            species_counts = np.bincount(codes, minlength=num_taxa)
+            read_totals = group_sums(reads)
+            if self.location_hits.counts.dtype.kind in "iub":
+                read_totals = np.rint(read_totals).astype(np.int64)
+            max_scores = np.full(num_taxa, np.nan)
+            np.fmax.at(max_scores, codes, scores)
+            present = species_counts > 0
+            with np.errstate(invalid="ignore"):
+                mean_scores = group_sums(scores) / species_counts
+            rollup = pd.DataFrame(
+                {
+                    "Flagged Species": species_counts,
+                    "Reads": read_totals,
+                    "Score-Weighted Reads": group_sums(reads * scores),
+                    "Mean Score": mean_scores,
+                    "Max Score": max_scores,
+                },
+                index=taxonomy.names[level],
+            )[present]
+            if level == "genus":
+                phyla = taxonomy.names["phylum"][taxonomy.genus_phylum[present]]
+                rollup.insert(0, "Phylum", phyla)
+            rollup = rollup.sort_values("Score-Weighted Reads", ascending=False)
+            rows["rows out"] = len(rollup)
+        return rollup
+
+    def build_reverse_table(self, filtered_bacteria):
+        """Create reverse table: properties and their corresponding bacteria.
+
+        Membership of every row in every property comes from one vectorized
+        test of the property masks.
+        """
+        membership = self.property_membership(filtered_bacteria)
+        species = filtered_bacteria[self.species_column_name].to_numpy()
 
         property_species_data = []
-        for prop in properties:
-            matching_species = filtered_bacteria[
-                filtered_bacteria["Contributing Properties"].apply(lambda x: prop in x)
-            ][self.species_column_name].tolist()
+        for prop, members in sorted(zip(self.mask_properties, membership.T)):
+            if not members.any():
+                continue
             property_species_data.append(
                 {
                     "Property": prop,
-                    "Number": len(matching_species),
-                    "Matching Species": matching_species,
+                    "Number": int(members.sum()),
+                    "Matching Species": species[members].tolist(),
                 }
             )
 
-        reverse_table = pd.DataFrame(property_species_data)
+        return pd.DataFrame(property_species_data)
+
+    def apply_thresholds(
+        self, sweep, score_threshold, reads_threshold, with_locations=True
+    ):
+        """Filter precomputed results; see filter_bacteria for the outputs.
+
+        Afterwards self.diagnostics holds the sweep's diagnostics plus any
+        raised while thresholding, and self.profile the sweep's stages plus
+        the thresholding ones.
+        """
+        self.diagnostics = list(sweep.diagnostics)
+        self.profile = sweep.profile.copy()
+        self.profile.trace_memory = self.trace_memory
+        self.profile.listener = self.stage_listener
+        self.species_column_name = sweep.species_df.columns[0]
+
+        # Store non-matching rows for later use
+        self.non_matching_rows_df = sweep.non_matching_rows_df
+        self.non_matching_rows = sweep.non_matching_rows_df.shape[0]
+
+        with self.profile.stage("thresholds", sweep.matching_rows) as rows:
+            filtered_bacteria, self.location_hits, reads_rows = self.select_rows(
+                sweep, score_threshold, reads_threshold
+            )
+            rows["rows out"] = filtered_bacteria.shape[0]
+        if not reads_rows:
+            # Handle the case where no rows meet the threshold
+            self.add_diagnostic(
+                "warning",
+                "No bacteria species meet the location count threshold.",
+            )
+            # For Streamlit, it's better to return early with empty results
+            return 0, 0, 0, 0
+
+        if with_locations:
+            filtered_bacteria = self.add_locations(filtered_bacteria)
+
+        with self.profile.stage("reverse table", filtered_bacteria.shape[0]) as rows:
+            reverse_table = self.build_reverse_table(filtered_bacteria)
+            rows["rows out"] = reverse_table.shape[0]
+        thresh_rows = filtered_bacteria.shape[0]
+        return sweep.matching_rows, filtered_bacteria, thresh_rows, reverse_table
+
+    def score_profiles(
+        self,
+        input_df,
+        profiles,
+        score_threshold,
+        reads_threshold,
+        input_counts=None,
+    ):
+        """Score an input under several weight profiles in one pass.
+
+        profiles maps a name to a score_weights dict. Matching and location
+        counting run once, for the union of the profiles' properties; the
+        scores for every profile then come from one product of the matched
+        species' property values with a properties x profiles weight matrix.
+        Each profile matches and scores species as filter_bacteria would
+        with its weights alone.
+
+        Returns (table, stats): table has one row per species matched
+        under any profile, with its "Num loc" at the reads threshold and a
+        score column per profile (NaN where not matched under it); stats has
+        "Num", "Matched" and "Above Threshold" per profile.
+        """
+        names = list(profiles)
+        union = {}
+        for weights in profiles.values():
+            for prop, weight in weights.items():
+                union[prop] = union.get(prop, 0) or weight
+        sweep = self.precompute(input_df, union, input_counts)
+
+        with self.profile.stage("profile scoring", sweep.matching_rows) as rows:
+            properties = sweep.property_names
+            weights = np.array(
+                [[profiles[name].get(prop, 0) for name in names] for prop in properties]
+            ).reshape(len(properties), len(names))
+            # Which profiles weight each property, even with weight 0
+            keys = np.array(
+                [[prop in profiles[name] for name in names] for prop in properties],
+                dtype=np.int64,
+            ).reshape(len(properties), len(names))
+            active = np.array([any(profiles[name].values()) for name in names])
+
+            # Matched as in match_species: some curated row of the species has
+            # a value for one of the profile's properties, or with a score
+            # bound any curated row
+            if sweep.name_matches is not None:
+                species = sweep.name_matches["Match"]
+            else:
+                species = sweep.species_df.iloc[:, 0]
+            known = self.curated_df[properties].notna()
+            if sweep.intervals is not None:
+                known[:] = True
+            has_value = known.groupby(self.curated_df["Species"]).any()
+            positions = has_value.index.get_indexer(species)
+            row_has = np.zeros((len(positions), len(properties)), dtype=np.int64)
+            row_has[positions >= 0] = has_value.to_numpy()[positions[positions >= 0]]
+            matched = ((row_has @ keys) > 0) & active
+
+            # Profiles weighting a non-numeric property score 0, as they do
+            # alone; the rest are scored on the numeric properties. Score
+            # bounds treat non-numeric values as unknown instead.
+            numeric = np.array(
+                [
+                    sweep.intervals is not None
+                    or pd.api.types.is_numeric_dtype(self.curated_df[prop])
+                    and self.curated_df[prop].dtype != bool
+                    for prop in properties
+                ],
+                dtype=bool,
+            )
+            values, found = sweep.property_values, sweep.found
+            if values is None:
+                numeric_properties = list(np.array(properties, dtype=object)[numeric])
+                values, _, found = self.gather_properties(species, numeric_properties)
+            unscorable = keys[~numeric].any(axis=0)
+            weights, keys = weights[numeric], keys[numeric]
+            scores = np.zeros((len(found), len(names)))
+            # A missing value makes the score NaN only for the profiles
+            # weighting that property
+            missing = np.isnan(values) if values.dtype.kind == "f" else None
+            if missing is not None:
+                values = np.where(missing, 0, values)
+            found_scores = (values @ weights).astype(np.float64)
+            if sweep.intervals is not None:
+                # Unknown values at the bound, as in score_intervals
+                reach = weights * sweep.intervals["upper"][:, None]
+                bound = np.minimum if self.score_bound == "min" else np.maximum
+                found_scores += sweep.intervals["unknown"] @ bound(reach, 0)
+            if missing is not None:
+                found_scores[(missing @ keys) > 0] = np.nan
+            scores[found] = found_scores
+            scores[:, unscorable] = 0
+
+            num_loc = sweep.num_loc(reads_threshold)
+            above = matched & (num_loc > 0)[:, None] & (scores >= score_threshold)
+            kept = matched.any(axis=1)
+            table = sweep.species_df[kept].copy()
+            if sweep.name_matches is not None:
+                table["Curated Species"] = species[kept].to_numpy()
+            table["Num loc"] = num_loc[kept]
+            profile_scores = np.where(matched, scores, np.nan)[kept]
+            for i, name in enumerate(names):
+                table[name] = profile_scores[:, i]
+            stats = pd.DataFrame(
+                {
+                    "Num": input_df.shape[0],
+                    "Matched": matched.sum(axis=0),
+                    "Above Threshold": above.sum(axis=0),
+                },
+                index=pd.Index(names, name="Profile"),
+            )
+            rows["rows out"] = len(table)
+        return table, stats
+
+    def filter_bacteria(
+        self,
+        input_df,
+        score_weights,
+        score_threshold,
+        reads_threshold,
+        with_locations=True,
+    ):
+        """Filter bacteria based on thresholds and weights.
+
+        With with_locations=False the "Locations" dicts are left out; they can
+        be built later for just the displayed rows with add_locations().
+        Warnings are collected in self.diagnostics rather than displayed.
+        To try several thresholds on the same input, call precompute() once
+        and apply_thresholds() for each combination instead.
+        """
+        sweep = self.precompute(input_df, score_weights)
+        return self.apply_thresholds(
+            sweep, score_threshold, reads_threshold, with_locations
+        )
+
+    def filter_bacteria_chunked(
+        self,
+        chunks,
+        score_weights,
+        score_threshold,
+        reads_threshold,
+        with_locations=True,
+    ):
+        """filter_bacteria over an input read in row chunks.
+
+        chunks is an iterable of DataFrames, e.g. from
+        pd.read_csv(path, chunksize=...). Each chunk is matched, scored and
+        thresholded on its own and only the passing rows are kept, so peak
+        memory follows the chunk size. Results match filter_bacteria on the
+        whole table, except that only the species column of the non-matching
+        rows is kept. The total number of input rows ends up in
+        self.num_input_rows.
+        """
+        diagnostics = []
+        pieces = []
+        hits = []
+        non_matching = []
+        matching_rows = 0
+        reads_rows = 0
+        self.num_input_rows = 0
+        # Stages are summed over chunks
+        profile = self.new_profile()
+
+        for chunk in chunks:
+            self.num_input_rows += chunk.shape[0]
+            sweep = self.precompute(chunk, score_weights)
+            profile.merge(sweep.profile)
+            diagnostics.extend(d for d in sweep.diagnostics if d not in diagnostics)
+            non_matching.append(sweep.non_matching_rows_df.iloc[:, :1])
+            matching_rows += sweep.matching_rows
+
+            with profile.stage("thresholds", sweep.matching_rows) as rows:
+                filtered_bacteria, location_hits, chunk_reads_rows = self.select_rows(
+                    sweep, score_threshold, reads_threshold
+                )
+                rows["rows out"] = filtered_bacteria.shape[0]
+            reads_rows += chunk_reads_rows
+            if not filtered_bacteria.empty or not pieces:
+                pieces.append(filtered_bacteria)
+                hits.append(location_hits)
+
+        if not pieces:
+            raise ValueError("No input chunks to check.")
+        self.profile = profile
+        self.diagnostics = diagnostics
+        self.species_column_name = pieces[0].columns[0]
+        self.non_matching_rows_df = pd.concat(non_matching)
+        self.non_matching_rows = self.non_matching_rows_df.shape[0]
+
+        if not reads_rows:
+            self.add_diagnostic(
+                "warning",
+                "No bacteria species meet the location count threshold.",
+            )
+            return 0, 0, 0, 0
+
+        filtered_bacteria = pd.concat(pieces)
+        self.location_hits = LocationHits.concat(hits)
+        if with_locations:
+            filtered_bacteria = self.add_locations(filtered_bacteria)
+
+        with profile.stage("reverse table", filtered_bacteria.shape[0]) as rows:
+            reverse_table = self.build_reverse_table(filtered_bacteria)
+            rows["rows out"] = reverse_table.shape[0]
+        thresh_rows = filtered_bacteria.shape[0]
         return matching_rows, filtered_bacteria, thresh_rows, reverse_table
@@ -0,0 +1,222 @@
+import numpy as np
+import pandas as pd
+
+# Most cells of a dense block built at once from sparse hits
+BLOCK_CELLS = 1 << 22
+
+
+class LocationHits:
+    """Locations where each row's reads reach the threshold, in CSR layout.
+
+    Row i's hits are columns[indices[indptr[i]:indptr[i + 1]]] with the
+    matching reads in counts, so dicts are only built for requested rows.
+    """
+
+    def __init__(self, index, columns, counts, reads_threshold):
+        above = counts >= reads_threshold
+        self.index = pd.Index(index)
+        self.columns = np.asarray(columns, dtype=object)
+        self.num_loc = above.sum(axis=1)
+        self.indptr = np.concatenate(([0], np.cumsum(self.num_loc)))
+        rows, self.indices = np.nonzero(above)
+        self.counts = counts[rows, self.indices]
+
+    @classmethod
+    def from_entries(cls, index, columns, rows, indices, counts):
+        """Hits from entries already sorted by row, then column."""
+        hits = cls.__new__(cls)
+        hits.index = pd.Index(index)
+        hits.columns = np.asarray(columns, dtype=object)
+        hits.num_loc = np.bincount(rows, minlength=len(hits.index))
+        hits.indptr = np.concatenate(([0], np.cumsum(hits.num_loc)))
+        hits.indices = indices
+        hits.counts = counts
+        return hits
+
+    @classmethod
+    def concat(cls, hits_list):
+        """Join the hits of consecutive row blocks with the same columns."""
+        hits = cls.__new__(cls)
+        hits.index = hits_list[0].index.append([h.index for h in hits_list[1:]])
+        hits.columns = hits_list[0].columns
+        hits.num_loc = np.concatenate([h.num_loc for h in hits_list])
+        hits.indptr = np.concatenate(([0], np.cumsum(hits.num_loc)))
+        hits.indices = np.concatenate([h.indices for h in hits_list])
+        hits.counts = np.concatenate([h.counts for h in hits_list])
+        return hits
+
+    def locations(self, labels):
+        """Build {location: count} dicts for the rows with these index labels."""
+        positions = self.index.get_indexer(labels)
+        dicts = [
+            dict(
+                zip(
+                    self.columns[self.indices[self.indptr[i] : self.indptr[i + 1]]],
+                    self.counts[self.indptr[i] : self.indptr[i + 1]].tolist(),
+                )
+            )
+            for i in positions
+        ]
+        return pd.Series(dicts, index=labels, dtype=object)
+
+    def row_totals(self, labels):
+        """Total reads at the hit locations of the rows with these labels."""
+        rows = np.repeat(np.arange(len(self.num_loc)), self.num_loc)
+        totals = np.bincount(rows, weights=self.counts, minlength=len(self.num_loc))
+        return totals[self.index.get_indexer(labels)]
+
+    def location_totals(self, labels, weights):
+        """Per-location sums over the rows with these labels.
+
+        Returns (totals, rows_hit): totals is H.T @ weights, where H holds
+        each row's reads at its hit locations and 0 elsewhere, so
+        totals[j, k] sums reads at location j times weights[row, k];
+        rows_hit[j] is how many of the rows hit location j. H is formed a
+        block of rows at a time, keeping memory bounded for any size.
+        """
+        positions = self.index.get_indexer(labels)
+        weights = np.asarray(weights, dtype=np.float64)
+        num_columns = len(self.columns)
+        totals = np.zeros((num_columns, weights.shape[1]))
+        rows_hit = np.zeros(num_columns, dtype=np.int64)
+        block_rows = max(1, BLOCK_CELLS // max(num_columns, 1))
+        for start in range(0, len(positions), block_rows):
+            block = positions[start : start + block_rows]
+            starts, lengths = self.indptr[block], self.num_loc[block]
+            rows = np.repeat(np.arange(len(block)), lengths)
+            entries = np.arange(lengths.sum()) + np.repeat(
+                starts - np.cumsum(lengths) + lengths, lengths
+            )
+            reads = np.zeros((len(block), num_columns))
+            reads[rows, self.indices[entries]] = self.counts[entries]
+            totals += reads.T @ weights[start : start + len(block)]
+            rows_hit += np.bincount(self.indices[entries], minlength=num_columns)
+        return totals, rows_hit
+
+
+class CountMatrix:
+    """Species x location read counts, held dense or sparse (CSR).
+
+    The sparse form stores only non-zero counts: row i's entries are
+    data[indptr[i]:indptr[i + 1]] at columns indices[...]. Either way each
+    row's values are also kept as sorted ranks, offset per row so the whole
+    matrix is one sorted array; the number of locations at or above any
+    reads threshold is then a single vectorized binary search.
+    """
+
+    def __init__(
+        self, columns, num_rows, dense=None, indptr=None, indices=None, data=None
+    ):
+        self.columns = columns
+        self.num_rows = num_rows
+        self.num_columns = len(columns)
+        self.dense = dense
+        self.sparse = dense is None
+        if self.sparse:
+            self.indptr, self.indices, self.data = indptr, indices, data
+            values = data
+        else:
+            self.indptr = np.arange(num_rows + 1) * self.num_columns
+            values = dense.ravel()
+        row_lengths = np.diff(self.indptr)
+        # Zeros left out of a sparse matrix
+        self.implicit_zeros = self.num_columns - row_lengths
+
+        # Missing counts never reach a threshold
+        values = values.astype(np.float64)
+        values[np.isnan(values)] = -np.inf
+        self.levels, ranks = np.unique(values, return_inverse=True)
+        ranks = ranks.ravel()
+        self.stride = len(self.levels) + 1
+        row_ids = np.repeat(np.arange(num_rows), row_lengths)
+        self.sorted_ranks = np.sort(ranks + row_ids * self.stride)
+
+        self.row_max = np.full(num_rows, -np.inf)
+        filled = row_lengths > 0
+        last = self.sorted_ranks[self.indptr[1:][filled] - 1] % self.stride
+        self.row_max[filled] = self.levels[last]
+        has_zeros = self.implicit_zeros > 0
+        self.row_max[has_zeros] = np.maximum(self.row_max[has_zeros], 0)
+
+    @classmethod
+    def from_frame(cls, frame, sparse=False):
+        """Build from the location columns of an input table.
+
+        The sparse form is assembled column by column, so no dense copy of
+        the whole table is made.
+        """
+        num_rows = frame.shape[0]
+        if not sparse:
+            return cls(frame.columns, num_rows, dense=frame.to_numpy())
+
+        rows, cols, data = [], [], []
+        for col in range(frame.shape[1]):
+            column = frame.iloc[:, col].to_numpy()
+            nonzero = np.flatnonzero(column != 0)
+            rows.append(nonzero)
+            cols.append(np.full(len(nonzero), col))
+            data.append(column[nonzero])
+        if rows:
+            rows, cols, data = (np.concatenate(a) for a in (rows, cols, data))
+        else:
+            rows = cols = np.zeros(0, dtype=int)
+            data = np.zeros(0)
+        order = np.lexsort((cols, rows))
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=num_rows))))
+        return cls(
+            frame.columns,
+            num_rows,
+            indptr=indptr,
+            indices=cols[order],
+            data=data[order],
+        )
+
+    def num_loc(self, reads_threshold, rows=None):
+        """Locations per row with reads >= reads_threshold.
+
+        rows limits the answer to those row positions; default is every row.
+        """
+        if rows is None:
+            rows = np.arange(self.num_rows)
+        level = np.searchsorted(self.levels, reads_threshold, side="left")
+        first = np.searchsorted(
+            self.sorted_ranks, rows * self.stride + level, side="left"
+        )
+        num_loc = self.indptr[rows + 1] - first
+        if reads_threshold <= 0:
+            num_loc = num_loc + self.implicit_zeros[rows]
+        return num_loc
+
+    def to_dense(self, rows):
+        """Dense counts for the given row positions."""
+        if not self.sparse:
+            return self.dense[rows]
+        dense = np.zeros((len(rows), self.num_columns), dtype=self.data.dtype)
+        for i, row in enumerate(rows):
+            start, end = self.indptr[row], self.indptr[row + 1]
+            dense[i, self.indices[start:end]] = self.data[start:end]
+        return dense
+
+    def location_hits(self, kept, index, reads_threshold):
+        """LocationHits for the rows at positions kept, labelled by index."""
+        if not self.sparse or reads_threshold <= 0:
+            # Zeros count too, so use the dense rows
+            return LocationHits(
+                index, self.columns, self.to_dense(kept), reads_threshold
+            )
+
+        starts, ends = self.indptr[kept], self.indptr[kept + 1]
+        lengths = ends - starts
+        rows = np.repeat(np.arange(len(kept)), lengths)
+        positions = np.arange(lengths.sum()) + np.repeat(
+            starts - np.cumsum(lengths) + lengths, lengths
+        )
+        above = self.data[positions] >= reads_threshold
+        positions = positions[above]
+        return LocationHits.from_entries(
+            index,
+            self.columns,
+            rows[above],
+            self.indices[positions],
+            self.data[positions],
+        )
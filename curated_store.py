@@ -0,0 +1,340 @@
+import copy
+import hashlib
+import io
+import json
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+from name_index import NameIndex
+from taxonomy import TaxonomyIndex
+
+CACHE_DIRNAME = ".cache"
+STORE_VERSION = 6
+
+# Process-wide caches, keyed by source path (overlays by their layers' paths)
+_curated_stores = {}
+_overlays = {}
+_score_weights = {}
+
+
+def file_stamp(path):
+    """Cheap change marker for a file: modification time and size."""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def content_hash(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def compact_dtype(values):
+    """Smallest dtype that holds small integer codes (and NaN) exactly."""
+    return np.float32 if np.isnan(values).any() else np.int8
+
+
+def is_property_column(column):
+    """Whether a curated column holds small integer codes, possibly missing."""
+    if not pd.api.types.is_numeric_dtype(column) or column.dtype == bool:
+        return False
+    values = column.dropna().to_numpy(dtype=np.float64)
+    return bool(
+        np.all(values == np.round(values))
+        and np.all(np.abs(values) <= np.iinfo(np.int8).max)
+    )
+
+
+class CuratedStore:
+    """Compiled form of a curated species list.
+
+    Holds a hash index from species name to the row of its first occurrence,
+    a NameIndex for loose name matching, a TaxonomyIndex of each row's genus
+    and phylum and a dense matrix of the property columns, stored in a
+    compact dtype. The original frame is kept for
+    display and for columns outside the matrix. A store built by
+    overlay_store() also records which layer supplied each value, and
+    absent (rows x columns) marks values of properties that no list naming
+    the species has; these score 0, as a property missing from a single
+    list is left out of every score.
+    """
+
+    def __init__(self, curated_df, source_hash=None, absent=None):
+        self.curated_df = curated_df
+        self.source_hash = source_hash
+        self.source_stamp = None
+        self.matrix_path = None
+
+        species = curated_df["Species"]
+        first = ~species.duplicated(keep="first")
+        self.species_index = pd.Index(species[first])
+        self.species_rows = np.flatnonzero(first.to_numpy())
+        self.name_index = NameIndex(self.species_index)
+        self.taxonomy = TaxonomyIndex(curated_df)
+
+        self.properties = []
+        self.property_dtypes = []
+        for col in curated_df.columns:
+            if is_property_column(curated_df[col]):
+                self.properties.append(col)
+                self.property_dtypes.append(curated_df[col].dtype)
+        values = curated_df[self.properties].to_numpy(dtype=np.float64)
+        self.absent = absent
+        if absent is not None:
+            values[absent[:, curated_df.columns.get_indexer(self.properties)]] = 0
+        self.matrix = np.ascontiguousarray(values.astype(compact_dtype(values)))
+        self.property_positions = {prop: i for i, prop in enumerate(self.properties)}
+
+        # Set by overlay_store: the layers' names and the layer of each value
+        # (rows x columns, -1 where no layer has one)
+        self.layer_names = []
+        self.value_layers = None
+
+    def __getstate__(self):
+        # A shared store travels without its matrix; it is re-mapped on load
+        state = self.__dict__.copy()
+        if self.matrix_path is not None:
+            state["matrix"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.matrix is None:
+            self.matrix = np.load(self.matrix_path, mmap_mode="r")
+
+    def shared_copy(self, matrix_path):
+        """Copy of the store whose matrix is memory-mapped from matrix_path.
+
+        Pickling the copy, e.g. to start worker processes, sends the index
+        and frame but not the matrix; every process maps the same file.
+        """
+        np.save(matrix_path, self.matrix)
+        shared = copy.copy(self)
+        shared.matrix_path = matrix_path
+        shared.matrix = np.load(matrix_path, mmap_mode="r")
+        return shared
+
+    def lookup_species(self, species):
+        """Return the curated row for each species name, or -1 if not curated."""
+        positions = self.species_index.get_indexer(species)
+        return np.where(positions >= 0, self.species_rows[positions], -1)
+
+    def property_matrix(self, properties):
+        """Return the curated values for properties and their original dtype.
+
+        Properties outside the compiled matrix are read from the frame, so
+        non-numeric columns come back with a non-numeric dtype as before.
+        """
+        if properties and all(prop in self.property_positions for prop in properties):
+            cols = [self.property_positions[prop] for prop in properties]
+            dtype = np.result_type(*[self.property_dtypes[col] for col in cols])
+            return self.matrix[:, cols], dtype
+        values = self.curated_df[properties].to_numpy()
+        return values, values.dtype
+
+    def source_layers(self, rows, properties):
+        """Bitmask per curated row of the layers supplying its properties.
+
+        Bit i stands for layer_names[i]; rows of -1 get 0, as does every row
+        of a store that is not an overlay.
+        """
+        rows = np.asarray(rows)
+        masks = np.zeros(len(rows), dtype=np.int64)
+        if self.value_layers is None or not len(rows):
+            return masks
+        columns = self.curated_df.columns.get_indexer(properties)
+        layers = self.value_layers[rows[rows >= 0]][:, columns[columns >= 0]]
+        bits = np.where(layers >= 0, np.left_shift(1, layers.astype(np.int64)), 0)
+        masks[rows >= 0] = np.bitwise_or.reduce(bits, axis=1)
+        return masks
+
+    def tristate_matrix(self, properties):
+        """Curated values of properties with unknown values marked.
+
+        Returns the values as float64 with 0 where unknown, a boolean mask
+        of the unknown ones and each property's largest known value (at
+        least 1). Missing and non-numeric values (e.g. "growth") are both
+        unknown, so every curated species gets a value or an unknown for
+        every property.
+        """
+        values = np.zeros((len(self.curated_df), len(properties)))
+        for i, prop in enumerate(properties):
+            if prop in self.property_positions:
+                values[:, i] = self.matrix[:, self.property_positions[prop]]
+            else:
+                values[:, i] = pd.to_numeric(self.curated_df[prop], errors="coerce")
+                if self.absent is not None:
+                    values[self.absent[:, self.curated_df.columns.get_loc(prop)], i] = 0
+        unknown = np.isnan(values)
+        values[unknown] = 0
+        upper = np.maximum(values.max(axis=0, initial=0), 1)
+        return values, unknown, upper
+
+
+def overlay_frame(frames):
+    """Merge curated frames into one row per species, earlier frames first.
+
+    Each value comes from the first frame that has it for the species (a
+    species listed twice in a frame uses its first row), so a later frame
+    only fills species and values the earlier ones lack. Returns the merged
+    frame, the frame each value came from (-1 if none) and which missing
+    values are absent: no frame listing the species has their column.
+    """
+    firsts = [
+        frame[~frame["Species"].duplicated()].set_index("Species") for frame in frames
+    ]
+    species = firsts[0].index
+    columns = firsts[0].columns
+    for first in firsts[1:]:
+        species = species.append(first.index[~first.index.isin(species)])
+        columns = columns.append(first.columns[~first.columns.isin(columns)])
+
+    merged = firsts[-1].reindex(index=species, columns=columns).astype(object)
+    value_layers = np.full(merged.shape, -1, dtype=np.int8)
+    value_layers[merged.notna().to_numpy()] = len(firsts) - 1
+    species_layers = np.zeros(len(species), dtype=np.int64)
+    first_layer = np.zeros(len(species), dtype=np.int8)
+    for i in reversed(range(len(firsts))):
+        listed = species.isin(firsts[i].index)
+        species_layers |= listed.astype(np.int64) << i
+        first_layer[listed] = i
+        if i == len(firsts) - 1:
+            continue
+        layer = firsts[i].reindex(index=species, columns=columns).astype(object)
+        known = layer.notna()
+        merged = layer.where(known, merged)
+        value_layers[known.to_numpy()] = i
+
+    # Object columns back to the types read_csv would give, e.g. int64 for
+    # whole numbers present in every row
+    merged = merged.infer_objects()
+    for col in merged.columns:
+        if pd.api.types.is_float_dtype(merged[col]):
+            values = merged[col].to_numpy()
+            if not np.isnan(values).any() and np.all(values == np.round(values)):
+                merged[col] = values.astype(np.int64)
+    merged = merged.rename_axis("Species").reset_index()
+    # The species name itself comes from the first layer listing it
+    value_layers = np.column_stack((first_layer, value_layers))
+
+    # Columns each species' frames have, from its frames as bits
+    has_column = np.array(
+        [
+            merged.columns.isin(first.columns) | (merged.columns == "Species")
+            for first in firsts
+        ]
+    )
+    listed = (species_layers[:, None] >> np.arange(len(firsts))) & 1
+    absent = ((listed @ has_column) == 0) & (value_layers < 0)
+    return merged, value_layers, absent
+
+
+def overlay_store(layers, names):
+    """One CuratedStore over several compiled layers, earliest first.
+
+    Scoring, matching and taxonomy then see a single species index in which
+    every value comes from the first layer having it; see overlay_frame.
+    The source hash combines the layers' names and hashes, as both show
+    in results.
+    """
+    merged, value_layers, absent = overlay_frame([layer.curated_df for layer in layers])
+    digest = content_hash(
+        repr([(name, layer.source_hash) for name, layer in zip(names, layers)]).encode()
+    )
+    store = CuratedStore(merged, digest, absent)
+    store.layer_names = list(names)
+    store.value_layers = value_layers
+    return store
+
+
+def compiled_path(path, cache_dir=None):
+    """Compiled stores live in a .cache directory next to the source CSV."""
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(path), CACHE_DIRNAME)
+    return os.path.join(cache_dir, os.path.basename(path) + ".store")
+
+
+def read_compiled(path, cache_dir=None):
+    """Load a previously compiled store for a curated CSV, or None."""
+    try:
+        with open(compiled_path(path, cache_dir), "rb") as f:
+            compiled = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+    if compiled.get("version") != STORE_VERSION:
+        return None
+    return compiled["store"]
+
+
+def write_compiled(store, path, cache_dir=None):
+    """Save a compiled store; a failed write only costs a reparse later."""
+    target = compiled_path(path, cache_dir)
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as f:
+            pickle.dump(
+                {"version": STORE_VERSION, "store": store},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+    except OSError as e:
+        print(f"Warning: could not write compiled curated list for {path}: {e}")
+
+
+def load_curated(path, cache_dir=None):
+    """Return the compiled store for a curated CSV, compiling it if needed.
+
+    Stores are cached per process and revalidated by file mtime and size;
+    when those change, the content hash decides whether to recompile.
+    """
+    stamp = file_stamp(path)
+    store = _curated_stores.get(path)
+    if store is not None and store.source_stamp == stamp:
+        return store
+
+    if store is None:
+        store = read_compiled(path, cache_dir)
+        if store is not None and store.source_stamp == stamp:
+            _curated_stores[path] = store
+            return store
+
+    with open(path, "rb") as f:
+        content = f.read()
+    digest = content_hash(content)
+    if store is None or store.source_hash != digest:
+        store = CuratedStore(pd.read_csv(io.BytesIO(content)), digest)
+    store.source_stamp = stamp
+    write_compiled(store, path, cache_dir)
+    _curated_stores[path] = store
+    return store
+
+
+def load_overlay(paths, names=None, cache_dir=None):
+    """Overlay store for curated CSVs, the first taking precedence.
+
+    Each layer is loaded with load_curated, so when one file changes only
+    that file is parsed and compiled again and the overlay is re-merged
+    from the compiled layers. names label the layers in provenance
+    (default: the file names).
+    """
+    if names is None:
+        names = [os.path.basename(path) for path in paths]
+    layers = [load_curated(path, cache_dir) for path in paths]
+    hashes = [layer.source_hash for layer in layers]
+    key = (tuple(paths), tuple(names))
+    cached = _overlays.get(key)
+    if cached is None or cached[0] != hashes:
+        cached = (hashes, overlay_store(layers, names))
+        _overlays[key] = cached
+    return cached[1]
+
+
+def load_score_weights(path):
+    """Return a fresh copy of the weights in a JSON file, cached per process."""
+    stamp = file_stamp(path)
+    cached = _score_weights.get(path)
+    if cached is None or cached[0] != stamp:
+        with open(path, "r") as f:
+            cached = (stamp, json.load(f))
+        _score_weights[path] = cached
+    return dict(cached[1])
@@ -0,0 +1,150 @@
+import importlib.util
+import os
+
+import numpy as np
+
+# Rows converted and written at a time
+CHUNK_ROWS = 10000
+
+FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+# Optional libraries each format needs
+FORMAT_MODULES = {"parquet": "pyarrow"}
+
+
+def missing_module(fmt):
+    """The library fmt needs if it is not installed, else None."""
+    module = FORMAT_MODULES.get(fmt)
+    if module is not None and importlib.util.find_spec(module) is None:
+        return module
+    return None
+
+
+def frame_chunks(frame, chunk_rows=CHUNK_ROWS, transform=None):
+    """Yield frame in blocks of chunk_rows rows, passed through transform.
+
+    transform adds what is only built per block, e.g. the "Locations" dicts.
+    An empty frame still yields one (empty) block, so the columns are known.
+    """
+    for start in range(0, max(len(frame), 1), chunk_rows):
+        chunk = frame.iloc[start : start + chunk_rows]
+        yield chunk if transform is None else transform(chunk)
+
+
+def write_csv(chunks, f):
+    """Write blocks to the binary file f as one CSV, header first."""
+    header = True
+    for chunk in chunks:
+        f.write(chunk.to_csv(index=False, header=header).encode())
+        header = False
+
+
+def arrow_ready(chunk):
+    # Dicts become (key, value) lists, which Arrow stores as a map
+    chunk = chunk.copy()
+    for name in chunk.columns[chunk.dtypes == object]:
+        values = chunk[name]
+        first = values.first_valid_index()
+        if first is not None and isinstance(values.loc[first], dict):
+            chunk[name] = [list(value.items()) for value in values]
+    return chunk
+
+
+def location_dtype(chunk):
+    """dtype of the counts in a block's "Locations" dicts.
+
+    The dicts hold the input's counts as Python numbers, so float counts
+    (blank cells, fractional abundances) come back as floats. int64 when
+    the block has no counts to tell from. Takes the dicts or the (key,
+    value) lists arrow_ready makes of them.
+    """
+    if "Locations" in chunk.columns:
+        for locations in chunk["Locations"]:
+            if isinstance(locations, dict):
+                locations = list(locations.items())
+            if isinstance(locations, list) and locations:
+                return np.asarray([count for _, count in locations]).dtype
+    return np.dtype(np.int64)
+
+
+def arrow_schema(chunk):
+    """Schema of the first block, with types it cannot tell filled in.
+
+    Later blocks are converted to the same schema, so a column that is all
+    missing here is read as strings and "Locations" as a map from string to
+    the counts' type (see location_dtype).
+    """
+    import pyarrow as pa
+
+    schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+    for i, field in enumerate(schema):
+        if field.name == "Locations":
+            counts = pa.from_numpy_dtype(location_dtype(chunk))
+            field = field.with_type(pa.map_(pa.string(), counts))
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        elif pa.types.is_list(field.type) and pa.types.is_null(field.type.value_type):
+            field = field.with_type(pa.list_(pa.string()))
+        schema = schema.set(i, field)
+    return schema
+
+
+def write_parquet(chunks, f):
+    """Write blocks to the binary file f as Parquet, one row group each.
+
+    Requires pyarrow, imported on first use.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in chunks:
+            chunk = arrow_ready(chunk)
+            if writer is None:
+                schema = arrow_schema(chunk)
+                writer = pq.ParquetWriter(f, schema)
+            writer.write_table(
+                pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            )
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+WRITERS = {"csv": write_csv, "parquet": write_parquet}
+
+
+def export_file(path, chunks, fmt, max_files=64):
+    """Write blocks to path in the given format unless it already exists.
+
+    The file appears only once complete. Other exports in its directory
+    beyond max_files are removed, oldest first. Returns path.
+    """
+    if os.path.exists(path):
+        return path
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    partial = f"{path}.part"
+    try:
+        with open(partial, "wb") as f:
+            WRITERS[fmt](chunks, f)
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+    # Sessions export into the same directory, so files may vanish meanwhile
+    try:
+        exported = sorted(
+            (
+                entry.path
+                for entry in os.scandir(directory)
+                if entry.path != path and not entry.name.endswith(".part")
+            ),
+            key=os.path.getmtime,
+        )
+        for old in exported[: max(0, len(exported) - max_files + 1)]:
+            os.remove(old)
+    except OSError:
+        pass
+    return path
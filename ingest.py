@@ -0,0 +1,50 @@
+import argparse
+import os
+import sys
+import time
+
+from input_store import ingest, open_table, table_path
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert input CSVs to memory-mapped tables for repeated checks."
+    )
+    parser.add_argument("inputs", nargs="+", help="Input CSV files")
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="Directory for the tables (default: next to each CSV)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+    for input_path in args.inputs:
+        path = table_path(input_path)
+        if args.output_dir is not None:
+            path = os.path.join(args.output_dir, os.path.basename(path))
+        start = time.perf_counter()
+        try:
+            ingest(input_path, path)
+        except (OSError, ValueError) as e:
+            print(f"{input_path}: {e}", file=sys.stderr)
+            return 1
+        elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        input_df, _ = open_table(path)
+        opened = time.perf_counter() - start
+        print(
+            f"{input_path} -> {path}: {input_df.shape[0]} species x "
+            f"{input_df.shape[1] - 1} locations, ingested in {elapsed:.2f} s, "
+            f"opens in {opened:.4f} s"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
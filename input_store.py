@@ -0,0 +1,121 @@
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from curated_store import content_hash
+
+TABLE_VERSION = 1
+TABLE_SUFFIX = ".table"
+
+
+def table_path(csv_path):
+    """Ingested tables sit next to their CSV, e.g. run1.csv -> run1.table."""
+    return os.path.splitext(csv_path)[0] + TABLE_SUFFIX
+
+
+def count_dtype(counts):
+    """int32 for integer counts that fit in it, else the counts' own dtype."""
+    if counts.dtype.kind in "iu" and counts.size:
+        info = np.iinfo(np.int32)
+        if counts.min() >= info.min and counts.max() <= info.max:
+            return np.int32
+    return counts.dtype
+
+
+def ingest(csv_path, path=None):
+    """Convert an input CSV into a memory-mappable table; returns its path.
+
+    The table is a directory holding the species names, one typed count
+    matrix (rows x locations, row-major) and the column names and content
+    hash of the CSV. All location columns must be numeric.
+    """
+    if path is None:
+        path = table_path(csv_path)
+    with open(csv_path, "rb") as f:
+        content = f.read()
+    input_df = pd.read_csv(io.BytesIO(content))
+
+    count_columns = input_df.columns[1:]
+    non_numeric = [
+        col
+        for col in count_columns
+        if not pd.api.types.is_numeric_dtype(input_df[col])
+        or input_df[col].dtype == bool
+    ]
+    if non_numeric:
+        raise ValueError(
+            f"{csv_path}: location columns must be numeric: {', '.join(non_numeric)}"
+        )
+    counts = input_df[count_columns].to_numpy()
+    counts = np.ascontiguousarray(counts, dtype=count_dtype(counts))
+    species = input_df.iloc[:, 0]
+    missing = species.isna().to_numpy()
+    names = species.fillna("").astype(str).to_numpy(dtype=str)
+
+    os.makedirs(path, exist_ok=True)
+    # The metadata goes last, so an interrupted ingest is not mistaken for one
+    meta_path = os.path.join(path, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    np.save(os.path.join(path, "counts.npy"), counts)
+    np.save(os.path.join(path, "species.npy"), names)
+    np.save(os.path.join(path, "missing.npy"), missing)
+    with open(meta_path, "w") as f:
+        json.dump(
+            {
+                "version": TABLE_VERSION,
+                "source hash": content_hash(content),
+                "species column": input_df.columns[0],
+                "columns": list(count_columns),
+            },
+            f,
+        )
+    return path
+
+
+def open_table(path):
+    """Open an ingested table as an input frame for the checker.
+
+    The counts are memory-mapped read-only and wrapped without copying, so
+    opening costs the same for any number of locations and processes that
+    open the same table share its pages. Only the species names are read
+    into memory. Returns the frame and the content hash of the source CSV,
+    so results are cached as for the CSV itself.
+    """
+    with open(os.path.join(path, "meta.json"), "r") as f:
+        meta = json.load(f)
+    if meta.get("version") != TABLE_VERSION:
+        raise ValueError(f"{path}: ingested with another version; ingest it again")
+
+    counts = np.load(os.path.join(path, "counts.npy"), mmap_mode="r")
+    species = pd.Series(np.load(os.path.join(path, "species.npy")))
+    missing = np.load(os.path.join(path, "missing.npy"))
+    if missing.any():
+        species = species.where(~missing)
+    input_df = pd.DataFrame(counts, columns=pd.Index(meta["columns"]), copy=False)
+    input_df.insert(0, meta["species column"], species)
+    return input_df, meta["source hash"]
+
+
+def is_table(path):
+    return os.path.isfile(os.path.join(path, "meta.json"))
+
+
+def list_tables(directory):
+    """Names of the ingested tables directly inside directory, sorted."""
+    try:
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+    except OSError:
+        return []
+    return [entry.name for entry in entries if entry.is_dir() and is_table(entry.path)]
+
+
+def load_input(path):
+    """Input frame and content hash for a CSV file or an ingested table."""
+    if is_table(path):
+        return open_table(path)
+    with open(path, "rb") as f:
+        content = f.read()
+    return pd.read_csv(io.BytesIO(content)), content_hash(content)
@@ -0,0 +1,297 @@
+import numpy as np
+import pandas as pd
+
+# Match types, from most to least certain
+EXACT = "exact"
+NORMALIZED = "normalized"
+GENUS_SPECIES = "genus species"
+FUZZY = "fuzzy"
+NO_MATCH = "none"
+
+# Confidence given to each kind of lookup; fuzzy matches use their similarity
+CONFIDENCE = {EXACT: 1.0, NORMALIZED: 0.95, GENUS_SPECIES: 0.8}
+
+
+def normalize_names(names):
+    """Lower-case names with brackets and quotes dropped and runs of spaces or
+    underscores collapsed to one space, e.g. " [Clostridium]_innocuum " ->
+    "clostridium innocuum"."""
+    return (
+        pd.Series(names, dtype=object)
+        .fillna("")
+        .astype(str)
+        .str.lower()
+        .str.replace(r"[\[\]'\"]", "", regex=True)
+        .str.replace(r"[\s_]+", " ", regex=True)
+        .str.strip()
+    )
+
+
+def genus_species(normalized):
+    """The first two words of normalized names, dropping strain suffixes."""
+    return normalized.str.split(" ", n=2).str[:2].str.join(" ")
+
+
+def code_points(strings, width):
+    """Code points of strings as an int array, zero-padded to width."""
+    # numpy has no zero-width string dtype; U0 becomes U1
+    padded = max(width, 1)
+    return (
+        np.asarray(strings, dtype=f"U{padded}")
+        .view(np.int32)
+        .reshape(len(strings), padded)[:, :width]
+    )
+
+
+def trigrams(names):
+    """Distinct trigrams of each name, padded as "  name ", as int codes.
+
+    Returns parallel arrays of name positions and trigram codes, sorted by
+    position then code, and the number of trigrams per name.
+    """
+    lengths = np.asarray([len(name) for name in names], dtype=np.int64)
+    width = int(lengths.max(initial=0)) + 3
+    padded = np.full((len(names), width), ord(" "), dtype=np.int64)
+    padded[:, 2:-1] = code_points(names, width - 3)
+    # Two padding spaces, the name, then one more in place of its padding
+    padded[np.arange(len(names)), lengths + 2] = ord(" ")
+    codes = (padded[:, :-2] << 42) | (padded[:, 1:-1] << 21) | padded[:, 2:]
+
+    rows = np.repeat(np.arange(len(names)), lengths + 1)
+    codes = codes[np.arange(width - 2) < (lengths + 1)[:, None]]
+    order = np.lexsort((codes, rows))
+    rows, codes = rows[order], codes[order]
+    distinct = np.ones(len(rows), dtype=bool)
+    distinct[1:] = (rows[1:] != rows[:-1]) | (codes[1:] != codes[:-1])
+    rows, codes = rows[distinct], codes[distinct]
+    return rows, codes, np.bincount(rows, minlength=len(names))
+
+
+def edit_distances(first, second):
+    """Levenshtein distance between first[i] and second[i] for every i.
+
+    All pairs advance through the dynamic programme together, one
+    character of the first strings per step; insertions within a row are
+    resolved with a running minimum instead of a loop.
+    """
+    first_lengths = np.asarray([len(a) for a in first], dtype=np.int64)
+    second_lengths = np.asarray([len(b) for b in second], dtype=np.int64)
+    num_pairs = len(first)
+    distances = np.zeros(num_pairs, dtype=np.int64)
+    if not num_pairs:
+        return distances
+
+    first_codes = code_points(first, max(first_lengths.max(), 1))
+    second_codes = code_points(second, second_lengths.max() + 1)
+    columns = np.arange(second_codes.shape[1] + 1, dtype=np.int32)
+    rows = np.arange(num_pairs)
+    previous = np.tile(columns, (num_pairs, 1))
+    distances[first_lengths == 0] = second_lengths[first_lengths == 0]
+    for i in range(first_codes.shape[1]):
+        cost = first_codes[:, i : i + 1] != second_codes
+        current = np.empty_like(previous)
+        current[:, 0] = i + 1
+        current[:, 1:] = np.minimum(previous[:, 1:] + 1, previous[:, :-1] + cost)
+        current = np.minimum.accumulate(current - columns, axis=1) + columns
+        done = first_lengths == i + 1
+        distances[done] = current[rows[done], second_lengths[done]]
+        previous = current
+    return distances
+
+
+def expand_ranges(starts, lengths):
+    """Concatenation of range(start, start + length) for each pair."""
+    offsets = np.arange(lengths.sum()) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths
+    )
+    return np.repeat(starts, lengths) + offsets
+
+
+class NameIndex:
+    """Lookup of input species names against curated names, loosest last.
+
+    Names are tried exactly, then normalized (case, spacing, underscores,
+    brackets), then by genus and species alone, and whatever is left by
+    trigram similarity (Dice coefficient) against every curated name.
+    """
+
+    def __init__(self, species):
+        species = pd.Series(species, dtype=object).dropna()
+        self.species = pd.Index(pd.unique(species))
+        normalized = normalize_names(self.species)
+
+        # First curated name per normalized form
+        first = ~normalized.duplicated()
+        self.normalized = pd.Index(normalized[first])
+        self.normalized_species = self.species[first.to_numpy()]
+
+        # A plain binomial wins over its subspecies for the same key
+        keys = genus_species(normalized)
+        order = np.argsort((keys != normalized).to_numpy(), kind="stable")
+        keys = keys.iloc[order]
+        first = ~keys.duplicated()
+        self.genus_species = pd.Index(keys[first])
+        self.genus_species_names = self.species[order[first.to_numpy()]]
+
+        # Trigram postings: curated names (by normalized position) per trigram
+        name_ids, codes, self.gram_counts = trigrams(self.normalized.to_numpy())
+        # Trigram ids number the distinct trigram codes in sorted order
+        self.gram_codes, gram_ids = np.unique(codes, return_inverse=True)
+        order = np.argsort(gram_ids, kind="stable")
+        self.posting_names = name_ids[order]
+        self.posting_ptr = np.searchsorted(
+            gram_ids[order], np.arange(len(self.gram_codes) + 1)
+        )
+        self.gram_frequency = np.diff(self.posting_ptr)
+        # Bit (name, trigram) says whether the name has that trigram
+        has_gram = np.zeros((len(self.normalized), len(self.gram_codes)), dtype=bool)
+        has_gram[name_ids, gram_ids] = True
+        self.name_grams = np.packbits(has_gram, axis=1)
+
+    def query_grams(self, queries):
+        """Known trigram ids of each query, rarest first, and trigram counts.
+
+        Returns (rows, grams, sizes, unknown): parallel query-row and
+        trigram-id arrays, each query's number of distinct trigrams and how
+        many of them no curated name has.
+        """
+        rows, codes, sizes = trigrams(queries)
+        grams = np.searchsorted(self.gram_codes, codes)
+        known = self.gram_codes[np.minimum(grams, len(self.gram_codes) - 1)] == codes
+        rows, grams = rows[known], grams[known]
+        order = np.lexsort((self.gram_frequency[grams], rows))
+        unknown = sizes - np.bincount(rows, minlength=len(sizes))
+        return rows[order], grams[order], sizes, unknown
+
+    def fuzzy_lookup(self, queries, min_similarity, probes=6, candidates=8):
+        """Best curated position and similarity for each normalized query.
+
+        Candidates are the names sharing the most of a query's `probes`
+        rarest trigrams, whose postings are short; the top `candidates` of
+        them are then scored exactly (Dice similarity over all trigrams).
+        A name reaching min_similarity must share one of the query's rarest
+        few trigrams, so short queries probe no more than that.
+        """
+        best = np.full(len(queries), -1, dtype=np.int64)
+        similarity = np.zeros(len(queries))
+        rows, grams, sizes, unknown = self.query_grams(queries)
+        if not len(rows):
+            return best, similarity
+
+        # Probe each query's rarest trigrams (prefix filtering)
+        min_shared = np.ceil(min_similarity * sizes / (2 - min_similarity))
+        prefix = np.minimum(sizes - min_shared + 1 - unknown, probes)
+        row_starts = np.searchsorted(rows, np.arange(len(queries) + 1))
+        rank = np.arange(len(rows)) - row_starts[rows]
+        probed = rank < prefix[rows]
+        starts = self.posting_ptr[grams[probed]]
+        lengths = self.posting_ptr[grams[probed] + 1] - starts
+        num_names = len(self.normalized)
+        pairs = np.repeat(rows[probed], lengths) * num_names
+        pairs += self.posting_names[expand_ranges(starts, lengths)]
+
+        # Keep the names hit most often per query
+        pairs, hits = np.unique(pairs, return_counts=True)
+        pair_rows = pairs // num_names
+        order = np.lexsort((-hits, pair_rows))
+        rank = np.arange(len(order)) - np.searchsorted(
+            pair_rows[order], pair_rows[order]
+        )
+        top = order[rank < candidates]
+        pair_rows, names = pair_rows[top], pairs[top] % num_names
+
+        # Exact shared trigram counts of the candidates
+        lengths = row_starts[pair_rows + 1] - row_starts[pair_rows]
+        query_grams = grams[expand_ranges(row_starts[pair_rows], lengths)]
+        names_per_gram = np.repeat(names, lengths)
+        found = (
+            self.name_grams[names_per_gram, query_grams >> 3] >> (7 - (query_grams & 7))
+        ) & 1
+        shared = np.bincount(
+            np.repeat(np.arange(len(names)), lengths),
+            weights=found,
+            minlength=len(names),
+        )
+        dice = 2 * shared / (sizes[pair_rows] + self.gram_counts[names])
+
+        # Best candidate per query
+        order = np.lexsort((-dice, pair_rows))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = pair_rows[order][1:] != pair_rows[order][:-1]
+        top = order[first]
+        keep = dice[top] >= min_similarity
+        best[pair_rows[top][keep]] = names[top][keep]
+        similarity[pair_rows[top][keep]] = dice[top][keep]
+        return best, similarity
+
+    def resolve(self, names, fuzzy=True, min_similarity=0.7, max_edit_rate=0.05):
+        """Match input names to curated ones.
+
+        Returns a frame aligned with names holding the curated "Match" (None
+        when nothing is close enough), the "Match Type" ("exact",
+        "normalized", "genus species", "fuzzy" or "none") and a
+        "Confidence" between 0 and 1. Each distinct name is looked up once.
+
+        Similar names are often different species (e.g. Streptococcus canis
+        and S. caviae), so a fuzzy match must also be within
+        1 + max_edit_rate x length edits of the query, i.e. a typo or two.
+        max_edit_rate=None drops that check, e.g. for suggestions.
+        """
+        names = pd.Series(names, dtype=object).fillna("")
+        unique = pd.Index(pd.unique(names))
+        match = np.full(len(unique), None, dtype=object)
+        match_type = np.full(len(unique), NO_MATCH, dtype=object)
+        confidence = np.zeros(len(unique))
+
+        def settle(todo, positions, candidates, kind):
+            # Record the hits; return which of todo are still unmatched
+            hit = positions >= 0
+            match[todo[hit]] = candidates[positions[hit]]
+            match_type[todo[hit]] = kind
+            confidence[todo[hit]] = CONFIDENCE[kind]
+            return ~hit
+
+        todo = np.arange(len(unique))
+        missed = settle(
+            todo, self.species.get_indexer(unique), self.species.to_numpy(), EXACT
+        )
+        todo = todo[missed]
+        normalized = normalize_names(unique[todo]).to_numpy()
+        missed = settle(
+            todo,
+            self.normalized.get_indexer(normalized),
+            self.normalized_species.to_numpy(),
+            NORMALIZED,
+        )
+        todo, normalized = todo[missed], normalized[missed]
+        keys = genus_species(pd.Series(normalized, dtype=object))
+        missed = settle(
+            todo,
+            self.genus_species.get_indexer(keys),
+            self.genus_species_names.to_numpy(),
+            GENUS_SPECIES,
+        )
+        todo, normalized = todo[missed], normalized[missed]
+        # Blank names resemble nothing
+        todo, normalized = todo[normalized != ""], normalized[normalized != ""]
+
+        if fuzzy and len(todo):
+            best, similarity = self.fuzzy_lookup(normalized, min_similarity)
+            hit = best >= 0
+            if max_edit_rate is not None:
+                lengths = np.asarray([len(name) for name in normalized[hit]])
+                edits = edit_distances(normalized[hit], self.normalized[best[hit]])
+                hit[hit] = edits <= 1 + (lengths * max_edit_rate).astype(int)
+            match[todo[hit]] = self.normalized_species.to_numpy()[best[hit]]
+            match_type[todo[hit]] = FUZZY
+            confidence[todo[hit]] = similarity[hit]
+
+        positions = unique.get_indexer(names)
+        return pd.DataFrame(
+            {
+                "Match": match[positions],
+                "Match Type": match_type[positions],
+                "Confidence": confidence[positions],
+            },
+            index=names.index,
+        )
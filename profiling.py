@@ -0,0 +1,125 @@
+import contextlib
+import copy
+import json
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+# tracemalloc is process-wide, so traced stages in different threads (e.g.
+# background runs) take turns; a thread may nest its own stages
+_tracing_lock = threading.RLock()
+
+
+class PipelineProfile:
+    """Wall time, rows in/out and peak memory for each pipeline stage.
+
+    Stages run more than once (e.g. once per input chunk) are summed, with
+    the number of calls and the largest peak kept. Peak memory is the most
+    Python and numpy allocated above the stage's starting point, measured
+    with tracemalloc only when trace_memory is set, since tracing slows
+    allocation-heavy code. Traced stages run one at a time across threads;
+    allocations by untraced work in other threads still count.
+
+    listener, if given, is called as listener(name, "start") before each
+    stage and listener(name, "end") after it, e.g. to report progress; an
+    exception it raises at the start stops the run there.
+    """
+
+    def __init__(self, trace_memory=False, listener=None):
+        self.trace_memory = trace_memory
+        self.listener = listener
+        self.stages = {}
+
+    def copy(self):
+        """Copy of the recorded stages, without the listener."""
+        profile = PipelineProfile(self.trace_memory)
+        profile.stages = copy.deepcopy(self.stages)
+        return profile
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None):
+        """Time the enclosed block as stage name.
+
+        Yields a dict whose "rows out" the block can fill in.
+        """
+        if self.listener is not None:
+            self.listener(name, "start")
+        counts = {"rows in": rows_in, "rows out": None}
+        started_tracing = False
+        if self.trace_memory:
+            _tracing_lock.acquire()
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            seconds = time.perf_counter() - start
+            peak_bytes = None
+            if self.trace_memory:
+                peak_bytes = tracemalloc.get_traced_memory()[1] - baseline
+                if started_tracing:
+                    tracemalloc.stop()
+                _tracing_lock.release()
+            self.add(name, seconds, counts["rows in"], counts["rows out"], peak_bytes)
+        if self.listener is not None:
+            self.listener(name, "end")
+
+    def add(self, name, seconds, rows_in=None, rows_out=None, peak_bytes=None, calls=1):
+        """Record one run of a stage (or several, already summed)."""
+        record = self.stages.setdefault(
+            name,
+            {
+                "calls": 0,
+                "seconds": 0.0,
+                "rows in": None,
+                "rows out": None,
+                "peak bytes": None,
+            },
+        )
+        record["calls"] += calls
+        record["seconds"] += seconds
+        for key, value in (("rows in", rows_in), ("rows out", rows_out)):
+            if value is not None:
+                record[key] = (record[key] or 0) + int(value)
+        if peak_bytes is not None:
+            record["peak bytes"] = max(record["peak bytes"] or 0, peak_bytes)
+
+    def merge(self, other):
+        """Add the stages of another profile into this one."""
+        for name, record in other.stages.items():
+            self.add(
+                name,
+                record["seconds"],
+                record["rows in"],
+                record["rows out"],
+                record["peak bytes"],
+                record["calls"],
+            )
+
+    def total_seconds(self):
+        return sum(record["seconds"] for record in self.stages.values())
+
+    def to_dict(self):
+        return {
+            "total seconds": self.total_seconds(),
+            "memory traced": self.trace_memory,
+            "stages": [
+                {"stage": name, **record} for name, record in self.stages.items()
+            ],
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_frame(self):
+        """One row per stage, in the order the stages first ran."""
+        return pd.DataFrame(
+            self.to_dict()["stages"],
+            columns=["stage", "calls", "seconds", "rows in", "rows out", "peak bytes"],
+        )
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+# Part of every key; bump when the result columns or the checker state
+# cached with them change, so results spilled by older code are not served
+RESULT_VERSION = 1
+
+
+def result_key(
+    input_hash,
+    curated_hash,
+    score_weights,
+    score_threshold,
+    reads_threshold,
+    options=(),
+):
+    """Cache key for one run: input and curated contents, weights, thresholds.
+
+    options holds any other settings that change the result, e.g. how names
+    are matched. Keys include RESULT_VERSION.
+    """
+    parts = (
+        RESULT_VERSION,
+        input_hash,
+        curated_hash,
+        tuple(sorted(score_weights.items())),
+        score_threshold,
+        reads_threshold,
+    )
+    if options:
+        parts += (tuple(options),)
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+class ResultCache:
+    """Bounded LRU cache of results, optionally spilling evictions to disk.
+
+    Entries evicted from memory are pickled to spill_dir, which keeps at
+    most max_disk_entries files (oldest removed first). Hits, disk hits and
+    misses are counted so the cache can be sized. Safe to share between
+    threads, e.g. the sessions of the app.
+    """
+
+    def __init__(self, max_entries=16, spill_dir=None, max_disk_entries=256):
+        self.max_entries = max_entries
+        self.spill_dir = spill_dir
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # get() puts disk hits back, so the lock is re-entrant
+        self.lock = threading.RLock()
+
+    def spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{key}.pkl")
+
+    def get(self, key):
+        """Return the cached value for key, or None."""
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.spill_dir is not None:
+            try:
+                with open(self.spill_path(key), "rb") as f:
+                    value = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+                pass
+            else:
+                self.disk_hits += 1
+                self._put(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        with self.lock:
+            self._put(key, value)
+
+    def _put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            evicted_key, evicted = self.entries.popitem(last=False)
+            self._spill(evicted_key, evicted)
+
+    def spill(self, key, value):
+        """Write an evicted entry to disk; failures just drop it."""
+        with self.lock:
+            self._spill(key, value)
+
+    def _spill(self, key, value):
+        if self.spill_dir is None:
+            return
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(self.spill_path(key), "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            spilled = sorted(
+                (entry.path for entry in os.scandir(self.spill_dir)),
+                key=os.path.getmtime,
+            )
+            for path in spilled[: max(0, len(spilled) - self.max_disk_entries)]:
+                os.remove(path)
+        except OSError as e:
+            print(f"Warning: could not spill cached result {key}: {e}")
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "disk hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+
+# Process-wide cache shared by every session of the app
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache(max_entries=16, spill_dir=None):
+    """Return the process-wide ResultCache, creating it on first use."""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(max_entries, spill_dir)
+    return _result_cache
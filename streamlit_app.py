@@ -1,10 +1,27 @@
 import io
 import json
+import os
+import time
 
 import pandas as pd
 import streamlit as st
+from background import BackgroundRun
 from checkContamination import ContaminationChecker
+from curated_store import (
+    content_hash,
+    file_stamp,
+    load_curated,
+    load_overlay,
+    load_score_weights,
+)
 from display_utils import display_markdown
+from export import FORMATS, export_file, frame_chunks
+from input_store import list_tables, open_table
+from result_cache import get_result_cache, result_key
+
+# Ingested tables the app may open; put them here with
+# python ingest.py run1.csv --output-dir data/tables
+TABLES_DIR = "data/tables"
 
 # Sidebar - Menu Options
 st.sidebar.title("Check Contamination")
@@ -61,36 +78,64 @@ st.sidebar.title("Display Options")
 # Load curated species list
 curated_file = st.sidebar.radio(
     "Choose curated species list:",
-    ["Curated Species List", "Expanded Semi-Curated List"],
+    ["Curated Species List", "Expanded Semi-Curated List", "Both, Curated First"],
     format_func=lambda x: x,
 )
 
-# Map the selected option to the corresponding file path
-file_path = (
-    "data/curated_species.csv"
-    if curated_file == "Curated Species List"
-    else "data/semicurated.csv"
-)
+# Map the selected option to the corresponding file paths; with both, each
+# value comes from the curated list when it has one
+curated_paths = {
+    "Curated Species List": {"Curated": "data/curated_species.csv"},
+    "Expanded Semi-Curated List": {"Semi-Curated": "data/semicurated.csv"},
+    "Both, Curated First": {
+        "Curated": "data/curated_species.csv",
+        "Semi-Curated": "data/semicurated.csv",
+    },
+}[curated_file]
 
 show_curated = st.sidebar.checkbox("Show first few lines of Curated List", value=False)
+loose_matching = st.sidebar.checkbox(
+    "Match species names loosely (case, spacing, strain, spelling)", value=False
+)
+# Species missing a weighted value are left out, or scored at the lowest or
+# highest score the value allows
+score_bound = st.sidebar.radio(
+    "Species with unknown curated values",
+    [None, "min", "max"],
+    format_func=lambda bound: {
+        None: "Leave out",
+        "min": "Score at lowest possible",
+        "max": "Score at highest possible",
+    }[bound],
+)
+show_diagnostics = st.sidebar.checkbox(
+    "Show Diagnostics panel (time and memory per stage)", value=False
+)
 
 
-# @st.cache_data
 def load_data():
-    # Load curated species list
-    curated_df = pd.read_csv(file_path)
-
-    # Load score weights
-    with open("data/score_weights.txt", "r") as f:
-        default_score_weights = json.load(f)
+    # Compiled curated lists and weights are cached for the whole process
+    if len(curated_paths) > 1:
+        curated_store = load_overlay(list(curated_paths.values()), list(curated_paths))
+    else:
+        curated_store = load_curated(*curated_paths.values())
+    default_score_weights = load_score_weights("data/score_weights.txt")
 
-    return curated_df, default_score_weights
+    return curated_store, default_score_weights
 
 
-curated_df, default_score_weights = load_data()
+curated_store, default_score_weights = load_data()
+curated_df = curated_store.curated_df
 
 # Initialize Contamination Checker
-contamination_checker = ContaminationChecker(curated_df, default_score_weights)
+contamination_checker = ContaminationChecker(
+    curated_df,
+    default_score_weights,
+    curated_store,
+    trace_memory=show_diagnostics,
+    loose_matching=loose_matching,
+    score_bound=score_bound,
+)
 
 
 # Input File Selection
@@ -99,14 +144,45 @@ use_default_file = st.sidebar.checkbox(
     "Use default input file: sample-infile.csv", value=True
 )
 
+
+def parsed_input(key, read_bytes):
+    # Parse each input once per session: while a check runs, progress polling
+    # reruns this script several times a second
+    cached = st.session_state.get("parsed_input")
+    if cached is None or cached[0] != key:
+        input_bytes = read_bytes()
+        # Same content, same results, whichever way the file arrived
+        cached = (key, pd.read_csv(io.BytesIO(input_bytes)), content_hash(input_bytes))
+        st.session_state["parsed_input"] = cached
+    return cached[1], cached[2]
+
+
+def read_default_input():
+    with open("data/sample-infile.csv", "rb") as f:
+        return f.read()
+
+
 if use_default_file:
-    input_df = pd.read_csv("data/sample-infile.csv")
+    input_df, input_hash = parsed_input(
+        ("default", file_stamp("data/sample-infile.csv")), read_default_input
+    )
 else:
     uploaded_file = st.sidebar.file_uploader(
         "Upload a CSV file for comparison", type="csv"
     )
+    # Large tables converted once with ingest.py open without parsing. Only
+    # tables in TABLES_DIR are offered, never a path typed by the user.
+    table_name = st.sidebar.selectbox(
+        f"Or open a table made by ingest.py (in {TABLES_DIR})",
+        [None] + list_tables(TABLES_DIR),
+        format_func=lambda name: "None" if name is None else name,
+    )
     if uploaded_file is not None:
-        input_df = pd.read_csv(uploaded_file)
+        input_df, input_hash = parsed_input(
+            ("upload", uploaded_file.file_id), uploaded_file.getvalue
+        )
+    elif table_name is not None:
+        input_df, input_hash = open_table(os.path.join(TABLES_DIR, table_name))
     else:
         st.warning("Please upload a CSV file for comparison.")
         input_df = None  # Set input_df to None if no file is uploaded
@@ -168,13 +244,42 @@ with weights_expander:
 st.sidebar.title("Threshold Settings")
 
 # Radio buttons for Score Threshold and Reads Threshold with horizontal options
+score_thresholds = [1, 2, 3, 4, 5]
+reads_thresholds = [1, 10, 100, 1000, 10000]
 score_threshold = st.sidebar.radio(
-    "Score Threshold", [1, 2, 3, 4, 5], index=0, horizontal=True
+    "Score Threshold", score_thresholds, index=0, horizontal=True
 )
 reads_threshold = st.sidebar.radio(
-    "Reads Threshold", [1, 10, 100, 1000, 10000], index=0, horizontal=True
+    "Reads Threshold", reads_thresholds, index=0, horizontal=True
 )
 
+# Sidebar - Weight profiles to compare side by side
+st.sidebar.title("Weight Profiles")
+compare_profiles = st.sidebar.checkbox("Compare several weight profiles", value=False)
+if compare_profiles:
+    profile_files = st.sidebar.file_uploader(
+        "Upload weight profiles (JSON), one per file",
+        type="json",
+        accept_multiple_files=True,
+    )
+
+
+def weight_profiles():
+    # The default and current weights, then each uploaded file by name
+    profiles = {"Default": default_score_weights}
+    if st.session_state["score_weights"] != default_score_weights:
+        profiles["Current"] = dict(st.session_state["score_weights"])
+    for profile_file in profile_files or []:
+        name = profile_file.name.rsplit(".", 1)[0]
+        profile_file.seek(0)
+        profiles[name] = json.load(profile_file)
+    return profiles
+
+
+# Sidebar - Result cache, shared by all sessions of this process
+result_cache = get_result_cache(spill_dir="data/.cache/results")
+cache_stats = st.sidebar.empty()  # Filled in after this run
+
 # Sidebar - Recompute Option
 st.sidebar.title("Recompute Options")
 recompute_automatically = st.sidebar.checkbox(
@@ -190,6 +295,184 @@ if not recompute_automatically:
     #     st.session_state["show_intro"] = False  # Reset flag after display
 
 
+def next_threshold_sweep(checker, cached, score_weights):
+    # Scores do not depend on thresholds, so keep them across reruns. New
+    # weights rescore the kept sweep; a new curated list reuses its counts.
+    # This also runs in background threads, which must not touch
+    # st.session_state, so the kept (input, curated, sweep) entry is passed
+    # in and the one to keep next is returned.
+    curated_key = (curated_store.source_hash, loose_matching, score_bound)
+    if cached is None or cached[0] != input_hash:
+        sweep = checker.precompute(
+            input_df, score_weights, checker.input_counts(input_df)
+        )
+    elif cached[1] != curated_key:
+        sweep = checker.precompute(input_df, score_weights, cached[2].input_counts)
+    elif cached[2].score_weights != score_weights:
+        sweep = checker.update_weights(cached[2], score_weights)
+    else:
+        return cached
+    return (input_hash, curated_key, sweep)
+
+
+def get_threshold_sweep():
+    entry = next_threshold_sweep(
+        contamination_checker,
+        st.session_state.get("threshold_sweep"),
+        st.session_state["score_weights"],
+    )
+    st.session_state["threshold_sweep"] = entry
+    return entry[2]
+
+
+def expected_stages(cached, score_weights):
+    # The stages next_threshold_sweep and apply_thresholds will run
+    curated_key = (curated_store.source_hash, loose_matching, score_bound)
+    if cached is None or cached[0] != input_hash or cached[1] != curated_key:
+        stages = ["matching", "scoring", "location counting"]
+    elif cached[2].score_weights != score_weights:
+        stages = ["rescoring"]
+    else:
+        stages = []
+    return stages + ["thresholds", "reverse table"]
+
+
+def check_options():
+    # Checker settings that change results, for their cache keys
+    options = []
+    if loose_matching:
+        options.append("loose matching")
+    if score_bound is not None:
+        options.append(("score bound", score_bound))
+    return options
+
+
+def current_cache_key():
+    return result_key(
+        input_hash,
+        curated_store.source_hash,
+        st.session_state["score_weights"],
+        score_threshold,
+        reads_threshold,
+        options=check_options(),
+    )
+
+
+def start_check_run(cache_key):
+    """Compute the results for cache_key in a worker thread.
+
+    The run reports progress at every stage and publishes the matched row
+    count as soon as the sweep is ready. Changing any setting cancels it at
+    its next stage (see display_outputs).
+    """
+    cached = st.session_state.get("threshold_sweep")
+    score_weights = dict(st.session_state["score_weights"])
+    checker = contamination_checker  # A new one is made on every rerun
+
+    def work(run):
+        checker.stage_listener = run.stage_listener
+        entry = next_threshold_sweep(checker, cached, score_weights)
+        run.publish("matched", entry[2].matching_rows)
+        # Threshold changes reuse the precomputed scores
+        results = checker.apply_thresholds(
+            entry[2], score_threshold, reads_threshold, with_locations=False
+        )
+        return results, checker.result_state(), entry
+
+    return BackgroundRun(cache_key, work, expected_stages(cached, score_weights))
+
+
+def display_progress(run):
+    fraction, text = run.progress()
+    st.progress(fraction, text=text)
+    # Partial statistics, filled in as the stages finish
+    st.subheader("Statistics")
+    st.write(f"**Threshold: Score {score_threshold}, Count {reads_threshold}**")
+    st.table(
+        pd.DataFrame(
+            {
+                "Num": [len(input_df)],
+                "Matched": [run.partial.get("matched", "...")],
+                "Above Threshold": ["..."],
+            }
+        )
+    )
+
+
+def display_diagnostics(from_cache):
+    profile = contamination_checker.profile
+    with st.expander("Diagnostics", expanded=True):
+        st.write(f"**Total: {profile.total_seconds():.3f} s**")
+        if from_cache:
+            st.caption("Result served from the cache; timings are from its first run.")
+        elif not profile.trace_memory:
+            st.caption("Peak memory is only traced from runs with this panel open.")
+        st.dataframe(profile.to_frame())
+        st.download_button(
+            label="Download Profile (JSON)",
+            data=profile.to_json(indent=2),
+            file_name="profile.json",
+            mime="application/json",
+        )
+
+
+def display_page(frame, key, transform=None):
+    """Show one page of frame, with controls to move through all of it.
+
+    transform is applied to the rows on the page only.
+    """
+    col1, col2 = st.columns(2)
+    page_size = col1.selectbox(
+        "Rows per page", [25, 100, 500], index=1, key=f"{key} page size"
+    )
+    num_pages = max(1, -(-len(frame) // page_size))
+    # The page lives in session state alone, so it can be moved back below
+    # when fewer rows than before (e.g. a higher threshold) leave fewer pages
+    page_key = f"{key} page"
+    if page_key not in st.session_state:
+        st.session_state[page_key] = 1
+    elif st.session_state[page_key] > num_pages:
+        st.session_state[page_key] = num_pages
+    page = col2.number_input(
+        f"Page (of {num_pages})", min_value=1, max_value=num_pages, key=page_key
+    )
+    start = (page - 1) * page_size
+    rows = frame.iloc[start : start + page_size]
+    st.dataframe(rows if transform is None else transform(rows))
+    if len(rows):
+        st.caption(f"Rows {start + 1} to {start + len(rows)} of {len(frame)}")
+
+
+def display_downloads(cache_key, tables):
+    """Download buttons for complete tables, given as (name, frame, transform).
+
+    Each table is written to disk a block of rows at a time, once per result
+    and format, rather than built up as one string in memory.
+    """
+    st.subheader("Downloads")
+    fmt = st.radio("Format", list(FORMATS), horizontal=True, format_func=str.upper)
+    if not st.checkbox("Prepare downloads of the complete tables", value=False):
+        return
+    for column, (name, frame, transform) in zip(st.columns(len(tables)), tables):
+        file_name = f"{name.lower().replace(' ', '_')}.{fmt}"
+        path = f"data/.cache/exports/{cache_key}_{file_name}"
+        try:
+            export_file(path, frame_chunks(frame, transform=transform), fmt)
+        except ImportError as e:
+            st.error(
+                f"Error: {fmt.upper()} export needs a library that is not "
+                f"installed. Details: {str(e)}"
+            )
+            return
+        with open(path, "rb") as f:
+            column.download_button(
+                label=f"Download {name}",
+                data=f,
+                file_name=file_name,
+                mime=FORMATS[fmt],
+            )
+
+
 def display_outputs():
     # Check if any markdown is being displayed
     # st.write("Intro: ", st.session_state.get("show_intro"))
@@ -208,19 +491,43 @@ def display_outputs():
         st.subheader("Curated Species List (First Few Lines)")
         st.dataframe(curated_df.head())
 
-    if input_df is not None:
-        st.subheader("Input Comparison CSV (First Few Lines)")
-        st.dataframe(input_df.head())
-
-    # Run computations
-    (
-        matching_rows,
-        filtered_bacteria,
-        thresh_rows,
-        reverse_table,
-    ) = contamination_checker.filter_bacteria(
-        input_df, st.session_state["score_weights"], score_threshold, reads_threshold
-    )
+    if input_df is None:
+        return  # Nothing to check yet
+    st.subheader("Input Comparison CSV (First Few Lines)")
+    st.dataframe(input_df.head())
+
+    # Run computations in the background, reusing cached results for the
+    # same inputs. A run for older settings is cancelled.
+    cache_key = current_cache_key()
+    run = st.session_state.get("check_run")
+    if run is not None and run.key != cache_key:
+        run.cancel()
+        run = None
+    cached = result_cache.get(cache_key) if run is None else None
+    if cached is not None:
+        results, state = cached
+        st.session_state.pop("check_run", None)
+    else:
+        if run is None:
+            run = st.session_state["check_run"] = start_check_run(cache_key)
+        if not run.done():
+            display_progress(run)
+            time.sleep(0.25)
+            st.rerun()
+        del st.session_state["check_run"]
+        results, state, st.session_state["threshold_sweep"] = run.result()
+        result_cache.put(cache_key, (results, state))
+    contamination_checker.restore_result_state(state)
+    matching_rows, filtered_bacteria, thresh_rows, reverse_table = results
+
+    for diagnostic in contamination_checker.diagnostics:
+        if diagnostic["level"] == "warning":
+            st.warning(diagnostic["message"])
+        else:
+            st.info(diagnostic["message"])
+
+    if show_diagnostics:
+        display_diagnostics(cached is not None)
 
     # Handle case where no results were returned
     if isinstance(filtered_bacteria, int) and filtered_bacteria == 0:
@@ -239,13 +546,23 @@ def display_outputs():
     )
     st.table(stats_df)
 
+    show_sweep = st.checkbox("Show Above Threshold for all thresholds", value=False)
+    if show_sweep:
+        st.table(
+            get_threshold_sweep().threshold_grid(score_thresholds, reads_thresholds)
+        )
+
+    def displayed(rows):
+        # Location dicts are only built for the rows on screen
+        return contamination_checker.add_locations(rows).drop(columns="Property Mask")
+
     st.subheader("Filtered Bacteria List")
-    st.dataframe(filtered_bacteria.head(100))
+    display_page(filtered_bacteria, "filtered", displayed)
 
     show_reverse_table = st.checkbox("Show Table by Properties", value=False)
     if show_reverse_table:
         st.subheader("Table by Properties")
-        st.dataframe(reverse_table.head(100))
+        display_page(reverse_table, "reverse")
 
     show_venn = st.checkbox("Show Venn diagram of contributing properties", value=False)
     if show_venn:
@@ -282,6 +599,47 @@ def display_outputs():
                 mime="image/png",
             )
 
+    show_intersections = st.checkbox(
+        "Show all intersections of contributing properties", value=False
+    )
+    if show_intersections:
+        st.subheader("Property Intersections")
+        st.dataframe(contamination_checker.property_intersections(filtered_bacteria))
+
+    show_burden = st.checkbox("Show contamination burden by location", value=False)
+    if show_burden:
+        st.subheader("Burden by Location")
+        burden = contamination_checker.location_burden(filtered_bacteria)
+        burden = burden.sort_values("Score-Weighted Reads", ascending=False)
+        st.bar_chart(burden["Score-Weighted Reads"].head(20))
+        st.dataframe(burden)
+
+    show_taxonomy = st.checkbox("Show rollup by phylum and genus", value=False)
+    if show_taxonomy:
+        # Drill-down only regroups this result by the curated taxonomy index
+        st.subheader("Rollup by Phylum")
+        phyla = contamination_checker.taxonomy_rollup(filtered_bacteria, "phylum")
+        st.dataframe(phyla)
+        phylum = st.selectbox("Drill down into phylum", phyla.index)
+        # None when no species pass the score threshold
+        if phylum is not None:
+            genera = contamination_checker.taxonomy_rollup(filtered_bacteria, "genus")
+            taxonomy = curated_store.taxonomy
+            genera = genera[
+                genera.index.isin(taxonomy.names["genus"][taxonomy.genera_of(phylum)])
+            ]
+            st.subheader(f"Genera in {phylum}")
+            st.dataframe(genera)
+            genus = st.selectbox("Drill down into genus", genera.index)
+            if genus is not None:
+                st.subheader(f"Flagged Species in {genus}")
+                genus_code = curated_store.taxonomy.names["genus"].get_loc(genus)
+                in_genus = (
+                    contamination_checker.taxon_codes(filtered_bacteria, "genus")
+                    == genus_code
+                )
+                display_page(filtered_bacteria[in_genus], "genus", displayed)
+
     col1, col2, col3 = st.columns(3)
     show_unmatched = col1.checkbox("Show top unmatched rows", value=False)
     n = col2.number_input(
@@ -289,14 +647,100 @@ def display_outputs():
     )
     if show_unmatched:
         st.subheader("Top Unmatched Rows")
-        col3.dataframe(
-            contamination_checker.non_matching_rows_df.iloc[:n, 0].to_frame()
+        unmatched = contamination_checker.non_matching_rows_df.iloc[:n, 0]
+        # Closest curated names, to help fix the spelling in the input
+        suggestions = contamination_checker.match_names(unmatched, suggest=True)
+        st.dataframe(
+            unmatched.to_frame().join(
+                suggestions.rename(columns={"Match": "Closest Curated Species"})
+            )
         )
 
+    location_hits = contamination_checker.location_hits
+
+    def with_locations(rows):
+        rows = rows.drop(columns="Property Mask")
+        rows["Locations"] = location_hits.locations(rows.index)
+        return rows
+
+    display_downloads(
+        cache_key,
+        [
+            ("Filtered Bacteria", filtered_bacteria, with_locations),
+            ("Table by Properties", reverse_table, None),
+            ("Unmatched Rows", contamination_checker.non_matching_rows_df, None),
+        ],
+    )
+
+
+def display_profiles():
+    """Scores under every weight profile side by side, from one pass."""
+    if (
+        st.session_state.get("show_intro", False)
+        or st.session_state.get("show_issues", False)
+        or st.session_state.get("show_credits", False)
+    ):
+        return  # Exit early if any markdown is displayed
+
+    st.title("Compare Weight Profiles")
+    if input_df is None:
+        return  # Nothing to check yet
+
+    profiles = weight_profiles()
+    options = [
+        ("profiles", tuple((name, sorted(w.items())) for name, w in profiles.items()))
+    ] + check_options()
+    cache_key = result_key(
+        input_hash,
+        curated_store.source_hash,
+        {},
+        score_threshold,
+        reads_threshold,
+        options=options,
+    )
+    cached = result_cache.get(cache_key)
+    if cached is None:
+        # Reuse the location counts of the single-profile view, if any
+        kept = st.session_state.get("threshold_sweep")
+        input_counts = kept[2].input_counts if kept and kept[0] == input_hash else None
+        with st.spinner(f"Scoring {len(profiles)} profiles..."):
+            cached = contamination_checker.score_profiles(
+                input_df, profiles, score_threshold, reads_threshold, input_counts
+            )
+        result_cache.put(cache_key, cached)
+    table, stats = cached
+
+    st.subheader("Statistics per Profile")
+    st.write(f"**Threshold: Score {score_threshold}, Count {reads_threshold}**")
+    st.table(stats)
+    st.bar_chart(stats["Above Threshold"])
+
+    st.subheader("Scores per Profile")
+    st.caption("Blank where a species is not matched under a profile.")
+    display_page(table, "profiles")
+    display_downloads(
+        cache_key,
+        [
+            ("Profile Scores", table, None),
+            ("Profile Statistics", stats.reset_index(), None),
+        ],
+    )
+
 
 # Display outputs based on automatic or manual compute option
+display = display_profiles if compare_profiles else display_outputs
 if recompute_automatically or st.session_state.get("recompute_trigger", False):
-    display_outputs()
+    display()
     st.session_state["recompute_trigger"] = False
-elif "recompute_button" in locals() and recompute_button:
-    display_outputs()
+elif ("recompute_button" in locals() and recompute_button) or (
+    # Keep polling a run the Compute button started, unless settings changed
+    input_df is not None
+    and "check_run" in st.session_state
+    and st.session_state["check_run"].key == current_cache_key()
+):
+    display()
+
+cache_stats.caption(
+    "Result cache: {entries} entries, {hits} hits, "
+    "{disk hits} disk hits, {misses} misses".format(**result_cache.stats())
+)
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+# Taxon of curated species lacking one, e.g. lists without a Phylum column
+UNKNOWN = "Unknown"
+
+
+def genus_names(species):
+    """Genus implied by each species name: its first word, without brackets.
+
+    "[Clostridium] innocuum" -> "Clostridium"; for a Candidatus name the
+    first two words are kept, "Candidatus Pelagibacter ubique" ->
+    "Candidatus Pelagibacter".
+    """
+    words = (
+        pd.Series(species, dtype=object)
+        .fillna("")
+        .astype(str)
+        .str.replace(r"[\[\]'\"]", "", regex=True)
+        .str.split()
+    )
+    genus = words.str[0].where(
+        words.str[0] != "Candidatus", words.str[:2].str.join(" ")
+    )
+    return genus.fillna(UNKNOWN)
+
+
+class TaxonomyIndex:
+    """Genus and phylum of every curated row, as integer codes.
+
+    codes[level][row] numbers the taxon of curated row `row` within
+    names[level]. Each genus also gets the most common phylum among its
+    species, so genera can be listed under their phylum.
+    """
+
+    def __init__(self, curated_df):
+        genera = genus_names(curated_df["Species"])
+        if "Phylum" in curated_df.columns:
+            phyla = curated_df["Phylum"].astype(object).fillna(UNKNOWN)
+        else:
+            phyla = pd.Series(UNKNOWN, index=curated_df.index, dtype=object)
+        self.codes = {}
+        self.names = {}
+        for level, taxa in (("genus", genera), ("phylum", phyla)):
+            codes, names = pd.factorize(taxa.astype(str))
+            self.codes[level] = codes
+            self.names[level] = pd.Index(names, name=level.capitalize())
+
+        # Most common phylum per genus
+        pairs = pd.DataFrame(self.codes).value_counts(sort=True)
+        first = ~pairs.index.get_level_values("genus").duplicated()
+        genus_phylum = pairs.index[first]
+        self.genus_phylum = np.zeros(len(self.names["genus"]), dtype=np.int64)
+        self.genus_phylum[genus_phylum.get_level_values("genus")] = (
+            genus_phylum.get_level_values("phylum")
+        )
+
+    def row_codes(self, rows, level):
+        """Codes of the curated rows at level; -1 rows get -1."""
+        rows = np.asarray(rows)
+        return np.where(rows >= 0, self.codes[level][rows], -1)
+
+    def genera_of(self, phylum):
+        """Codes of the genera placed under the named phylum."""
+        code = self.names["phylum"].get_loc(phylum)
+        return np.flatnonzero(self.genus_phylum == code)
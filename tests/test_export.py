@@ -0,0 +1,62 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+from checkContamination import ContaminationChecker
+from export import arrow_ready, frame_chunks, location_dtype, write_csv, write_parquet
+
+CURATED = pd.DataFrame(
+    {"Species": ["Bacillus subtilis", "Streptococcus canis"], "aerobe": [1, 1]}
+)
+
+
+def filtered_rows(counts):
+    """Filtered rows, with "Locations", for an input with the given counts."""
+    input_df = pd.DataFrame({"#Datasets": CURATED["Species"], **counts})
+    checker = ContaminationChecker(CURATED, {"aerobe": 1})
+    _, filtered, _, _ = checker.filter_bacteria(input_df, {"aerobe": 1}, 1, 1)
+    return filtered
+
+
+COUNTS = {
+    "i": {"loc1": [10, 0], "loc2": [3, 7]},
+    # A blank cell makes the counts float
+    "f": {"loc1": [10.5, np.nan], "loc2": [3.0, 7.0]},
+}
+
+
+@pytest.fixture(params=sorted(COUNTS))
+def kind(request):
+    return request.param
+
+
+@pytest.fixture
+def filtered(kind):
+    return filtered_rows(COUNTS[kind])
+
+
+def test_frame_chunks_csv_matches_to_csv(filtered):
+    f = io.BytesIO()
+    write_csv(frame_chunks(filtered, chunk_rows=1), f)
+    assert f.getvalue().decode() == filtered.to_csv(index=False)
+
+
+def test_frame_chunks_empty_frame():
+    chunks = list(frame_chunks(pd.DataFrame(columns=["a", "b"])))
+    assert len(chunks) == 1 and list(chunks[0].columns) == ["a", "b"]
+
+
+def test_location_dtype(filtered, kind):
+    assert location_dtype(filtered).kind == kind
+    assert location_dtype(arrow_ready(filtered)).kind == kind
+    assert location_dtype(filtered.iloc[:0]) == np.int64
+
+
+def test_parquet_round_trip(filtered):
+    pq = pytest.importorskip("pyarrow.parquet")
+    f = io.BytesIO()
+    write_parquet(frame_chunks(filtered.drop(columns="Property Mask")), f)
+    f.seek(0)
+    table = pq.read_table(f).to_pandas()
+    assert [dict(items) for items in table["Locations"]] == list(filtered["Locations"])
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+from checkContamination import ContaminationChecker
+from name_index import (
+    EXACT,
+    FUZZY,
+    GENUS_SPECIES,
+    NO_MATCH,
+    NORMALIZED,
+    NameIndex,
+    code_points,
+    edit_distances,
+    trigrams,
+)
+
+CURATED = ["Bacillus subtilis", "Streptococcus canis", "[Clostridium] innocuum"]
+
+
+@pytest.fixture
+def index():
+    return NameIndex(CURATED)
+
+
+def test_code_points_zero_width():
+    assert code_points(["", ""], 0).shape == (2, 0)
+    assert code_points(["ab", ""], 3).tolist() == [[97, 98, 0], [0, 0, 0]]
+
+
+def test_trigrams_blank_and_short_names():
+    rows, codes, counts = trigrams(["", "ab"])
+    assert counts.tolist() == [1, 3]
+    assert len(rows) == len(codes) == 4
+
+
+@pytest.mark.parametrize(
+    "first, second, expected",
+    [
+        ("", "", 0),
+        ("", "abc", 3),
+        ("abc", "", 3),
+        ("kitten", "sitting", 3),
+        ("bacillus", "bacilus", 1),
+        ("same", "same", 0),
+    ],
+)
+def test_edit_distances(first, second, expected):
+    assert edit_distances([first], [second]).tolist() == [expected]
+
+
+def test_edit_distances_many_pairs():
+    first = ["kitten", "", "flaw", "abc"]
+    second = ["sitting", "x", "lawn", "abc"]
+    assert edit_distances(first, second).tolist() == [3, 1, 2, 0]
+
+
+def test_resolve_match_types(index):
+    result = index.resolve(
+        [
+            "Bacillus subtilis",
+            " bacillus_SUBTILIS ",
+            "Streptococcus canis strain X1",
+            "Bacilus subtilis",
+            "Escherichia coli",
+        ]
+    )
+    assert result["Match Type"].tolist() == [
+        EXACT,
+        NORMALIZED,
+        GENUS_SPECIES,
+        FUZZY,
+        NO_MATCH,
+    ]
+    assert result["Match"].tolist()[:4] == [
+        "Bacillus subtilis",
+        "Bacillus subtilis",
+        "Streptococcus canis",
+        "Bacillus subtilis",
+    ]
+    assert result["Confidence"].iloc[-1] == 0
+
+
+@pytest.mark.parametrize("names", [[""], ["", "  "], [np.nan, "", "_"]])
+@pytest.mark.parametrize("max_edit_rate", [0.1, None])
+def test_resolve_blank_names(index, names, max_edit_rate):
+    # Only blank names left for fuzzy lookup used to fail to reshape
+    result = index.resolve(names, min_similarity=0.5, max_edit_rate=max_edit_rate)
+    assert (result["Match Type"] == NO_MATCH).all()
+    assert result["Match"].isna().all()
+
+
+def test_resolve_blank_among_typos(index):
+    result = index.resolve(["", "Bacilus subtilis"])
+    assert result["Match Type"].tolist() == [NO_MATCH, FUZZY]
+
+
+def test_loose_matching_blank_species():
+    curated_df = pd.DataFrame({"Species": CURATED, "aerobe": [1, 0, 1]})
+    checker = ContaminationChecker(curated_df, {"aerobe": 1}, loose_matching=True)
+    input_df = pd.DataFrame(
+        {"#Datasets": ["Bacillus subtilis", ""], "loc1": [10, 5], "loc2": [0, 3]}
+    )
+    matching_rows, filtered, thresh_rows, _ = checker.filter_bacteria(
+        input_df, {"aerobe": 1}, 1, 1
+    )
+    assert matching_rows == 1 and thresh_rows == 1
+    assert filtered["Curated Species"].tolist() == ["Bacillus subtilis"]
+    assert checker.non_matching_rows == 1